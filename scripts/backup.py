@@ -9,6 +9,7 @@ Backups are organized as:
     ./backup/volumes/{account}/{region}/{volume-name}/ - shared filesystems
 """
 
+import functools
 import json
 import os
 import subprocess
@@ -17,27 +18,13 @@ from datetime import datetime
 from pathlib import Path
 
 import utils_accounts
+import utils_config
 import utils_db as db
 import utils_lambda_api as api
 
 PROJECT_DIR = Path(__file__).parent.parent
 
-
-# Load config
-def load_config():
-    config_path = PROJECT_DIR / "config.env"
-    config = {}
-    if config_path.exists():
-        with open(config_path) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    config[key.strip()] = value.strip()
-    return config
-
-
-CONFIG = load_config()
+CONFIG = utils_config.CONFIG
 BACKUP_DIR = Path(CONFIG.get("BACKUP_DIR", "./backup"))
 if not BACKUP_DIR.is_absolute():
     BACKUP_DIR = PROJECT_DIR / BACKUP_DIR
@@ -55,6 +42,7 @@ SSH_KEYS_DIR = Path(CONFIG.get("SSH_KEYS_DIR", "./keys"))
 if not SSH_KEYS_DIR.is_absolute():
     SSH_KEYS_DIR = PROJECT_DIR / SSH_KEYS_DIR
 SSH_KEYS_DIR = SSH_KEYS_DIR.expanduser()
+SSH_KEYS_DIR_EXISTS = SSH_KEYS_DIR.exists()
 
 SSH_KEY_DEFAULT = Path(CONFIG.get("SSH_KEY_DEFAULT", "~/.ssh/id_rsa")).expanduser()
 
@@ -80,8 +68,14 @@ def get_ssh_key_for_instance(instance: dict) -> Path:
     if isinstance(ssh_key_names, str):
         ssh_key_names = json.loads(ssh_key_names)
     
+    return _resolve_key(tuple(ssh_key_names))
+
+
+@functools.lru_cache(maxsize=256)
+def _resolve_key(ssh_key_names: tuple[str, ...]) -> Path:
+    """Resolve key names to a key path (cached: keys don't change during a run)."""
     # Try to find a matching key in the keys directory
-    if SSH_KEYS_DIR.exists():
+    if SSH_KEYS_DIR_EXISTS:
         for key_name in ssh_key_names:
             # Structure 1: Direct file (./keys/chen-sabotage)
             key_path = SSH_KEYS_DIR / key_name
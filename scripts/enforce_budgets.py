@@ -11,32 +11,15 @@ Run via cron every 5 minutes.
 import json
 import time
 from datetime import datetime
-from pathlib import Path
 
 import requests
 
 import utils_accounts
+import utils_config
 import utils_db as db
 import utils_lambda_api as lambda_api
 
-PROJECT_DIR = Path(__file__).parent.parent
-
-
-def load_config():
-    """Load config.env for defaults."""
-    config_path = PROJECT_DIR / "config.env"
-    config = {}
-    if config_path.exists():
-        with open(config_path) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    config[key.strip()] = value.strip()
-    return config
-
-
-CONFIG = load_config()
+CONFIG = utils_config.CONFIG
 DEFAULT_LIMIT = int(CONFIG.get("BUDGET_LIMIT_DEFAULT", "500000"))
 MILESTONE_INTERVAL = int(CONFIG.get("BUDGET_MILESTONE_INTERVAL", "100000"))
 
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+GPU stats agent: runs on each Lambda machine and keeps GPU utilization in a file.
+Copied and started by monitor.py's initialize_machine (via init_machine.sh).
+
+monitor.py reads the stats file over its existing SSH session instead of starting
+nvidia-smi on every poll. Uses NVML (pynvml) when available, otherwise a single
+long-running `nvidia-smi -l` process.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+STATS_PATH = "/tmp/heron_gpu_stats"
+INTERVAL_SECONDS = 10
+
+
+def write_stats(values: list[int]):
+    """Atomically replace STATS_PATH with one utilization value per line."""
+    tmp_path = f"{STATS_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("".join(f"{v}\n" for v in values))
+    os.replace(tmp_path, STATS_PATH)
+
+
+def run_nvml():
+    """Sample utilization through NVML; device handles are looked up once."""
+    import pynvml
+
+    pynvml.nvmlInit()
+    try:
+        handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+        while True:
+            write_stats([pynvml.nvmlDeviceGetUtilizationRates(h).gpu for h in handles])
+            time.sleep(INTERVAL_SECONDS)
+    finally:
+        pynvml.nvmlShutdown()
+
+
+def run_nvidia_smi():
+    """Sample utilization from one long-lived nvidia-smi process (no per-sample startup)."""
+    proc = subprocess.Popen(
+        [
+            "nvidia-smi",
+            "--query-gpu=index,utilization.gpu",
+            "--format=csv,noheader,nounits",
+            "-l", str(INTERVAL_SECONDS),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    # Each sample is one line per GPU, starting again from index 0
+    values = []
+    for line in proc.stdout:
+        parts = [p.strip() for p in line.split(",")]
+        if len(parts) != 2:
+            continue
+        if parts[0] == "0" and values:
+            write_stats(values)
+            values = []
+        values.append(int(parts[1]))
+
+    sys.exit(proc.wait())
+
+
+def main():
+    try:
+        import pynvml  # noqa: F401
+    except ImportError:
+        run_nvidia_smi()
+    else:
+        run_nvml()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,11 @@ if [ -f /tmp/setup_ssh_keys.sh ]; then
     /tmp/setup_ssh_keys.sh /tmp/public_keys.txt
 fi
 
+# Start GPU stats agent (gpu_agent.py, copied by monitor.py); monitor reads its stats file
+if [ -f /tmp/heron_gpu_agent.py ] && ! pgrep -f heron_gpu_agent.py > /dev/null; then
+    nohup setsid python3 /tmp/heron_gpu_agent.py > /dev/null 2>&1 < /dev/null &
+fi
+
 cd ~
 
 # Clone dotfiles
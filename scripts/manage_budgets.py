@@ -9,6 +9,8 @@ Usage:
 """
 
 import argparse
+import functools
+import operator
 import sys
 from pathlib import Path
 
@@ -17,7 +19,11 @@ import utils_db as db
 
 PROJECT_DIR = Path(__file__).parent.parent
 
+# Row layout for the `list` table
+ROW_FORMAT = "  {name:<20} │ {limit:>10} │ {spent:>10} │ {remaining:>10} │ {discord:^8}"
 
+
+@functools.lru_cache(maxsize=4096)
 def format_money(cents: int | float) -> str:
     """Format cents as dollar string."""
     return f"${cents / 100:,.0f}"
@@ -39,19 +45,19 @@ def cmd_list(args):
             return
         
         default_limit = data.get("defaults", {}).get("limit_cents", 500000)
-        print(f"\n  Account Budget Status  │  Default limit: {format_money(default_limit)}\n")
-        
-        # Header
-        print(f"  {'Account':<20} │ {'Limit':>10} │ {'Spent':>10} │ {'Remaining':>10} │ Discord")
-        print(f"  {'-'*20}-┼-{'-'*10}-┼-{'-'*10}-┼-{'-'*10}-┼-{'-'*8}")
+        lines = [
+            f"\n  Account Budget Status  │  Default limit: {format_money(default_limit)}\n",
+            ROW_FORMAT.format(name="Account", limit="Limit", spent="Spent", remaining="Remaining", discord="Discord").rstrip(),
+            f"  {'-'*20}-┼-{'-'*10}-┼-{'-'*10}-┼-{'-'*10}-┼-{'-'*8}",
+        ]
         
         # Sort by spent descending
-        sorted_accounts = sorted(accounts, key=lambda a: costs.get(a["name"], 0), reverse=True)
+        pairs = [(acc, costs.get(acc["name"], 0)) for acc in accounts]
+        pairs.sort(key=operator.itemgetter(1), reverse=True)
         
-        for acc in sorted_accounts:
+        for acc, spent in pairs:
             name = acc["name"]
             limit = acc["limit_cents"]
-            spent = costs.get(name, 0)
             remaining = limit - spent
             
             # Check if using custom or default limit
@@ -76,10 +82,17 @@ def cmd_list(args):
             # Truncate long names
             display_name = name[:20] if len(name) <= 20 else name[:17] + "..."
             
-            print(f"  {display_name:<20} │ {limit_str:>10} │ {format_money(spent):>10} │ {remaining_str:>10} │ {discord:^8}")
+            lines.append(ROW_FORMAT.format(
+                name=display_name,
+                limit=limit_str,
+                spent=format_money(spent),
+                remaining=remaining_str,
+                discord=discord,
+            ))
         
-        print(f"\n  * = using default limit")
-        print(f"  ! = <20% remaining, ⚠ = over budget\n")
+        lines.append(f"\n  * = using default limit")
+        lines.append(f"  ! = <20% remaining, ⚠ = over budget\n")
+        sys.stdout.write("\n".join(lines) + "\n")
         
     finally:
         conn.close()
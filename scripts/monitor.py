@@ -5,36 +5,29 @@ Supports multiple Lambda Labs accounts.
 Run via cron every minute.
 """
 
-import json
+import asyncio
 import os
+import shutil
 import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 import utils_accounts
+import utils_config
 import utils_db as db
 import utils_lambda_api as lambda_api
 
-PROJECT_DIR = Path(__file__).parent.parent
-
-
-# Load config
-def load_config():
-    config_path = PROJECT_DIR / "config.env"
-    config = {}
-    if config_path.exists():
-        with open(config_path) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    config[key.strip()] = value.strip()
-    return config
+try:
+    import asyncssh  # Optional: polls all hosts concurrently from one event loop
+except ImportError:
+    asyncssh = None
 
+PROJECT_DIR = Path(__file__).parent.parent
 
-CONFIG = load_config()
+CONFIG = utils_config.CONFIG
 IDLE_SHUTDOWN_HOURS = float(CONFIG.get("IDLE_SHUTDOWN_HOURS", "2"))
 SSH_CONFIG_PATH = Path(CONFIG.get("SSH_CONFIG_PATH", "~/.ssh/config")).expanduser()
 SSH_USER = CONFIG.get("SSH_USER", "ubuntu")
@@ -46,11 +39,36 @@ SSH_KEYS_DIR = SSH_KEYS_DIR.expanduser()
 SSH_KEY_DEFAULT = Path(CONFIG.get("SSH_KEY_DEFAULT", "~/.ssh/id_rsa")).expanduser()
 INIT_SCRIPT_PATH = CONFIG.get("INIT_SCRIPT_PATH", "")
 
+# Absolute binary paths + close_fds=False let subprocess use posix_spawn instead of
+# fork+exec (our own fds are non-inheritable, so nothing leaks into the child)
+SSH_BIN = shutil.which("ssh") or "ssh"
+SCP_BIN = shutil.which("scp") or "scp"
+# Small, fixed-locale environment for ssh/scp children (keeps SSH_AUTH_SOCK for agent-held keys)
+SSH_ENV = {k: v for k, v in os.environ.items() if k in ("PATH", "HOME", "USER", "SSH_AUTH_SOCK")}
+SSH_ENV.update({"LC_ALL": "C", "LANG": "C"})
+
+# SSH connection multiplexing: the first ssh to a host leaves a master connection
+# running for SSH_CONTROL_PERSIST, and later ssh/scp calls reuse it (no new handshake).
+# The socket directory is created by main(), not on import
+SSH_CONTROL_DIR = Path("~/.ssh/heron-cm").expanduser()
+SSH_CONTROL_PATH = str(SSH_CONTROL_DIR / "%C")
+SSH_CONTROL_PERSIST = "10m"
+
+# Max concurrent ssh subprocesses when polling instances
+POLL_MAX_WORKERS = 32
+# Max accounts processed concurrently (each with its own DB connection)
+ACCOUNT_MAX_WORKERS = 8
+
+# Unreachable hosts are re-probed after min(MAX, BASE * 2**failures) seconds
+GPU_PROBE_BACKOFF_BASE_SECONDS = int(CONFIG.get("SSH_BACKOFF_BASE_SECONDS", "30"))
+GPU_PROBE_BACKOFF_MAX_SECONDS = int(CONFIG.get("SSH_BACKOFF_MAX_SECONDS", "1800"))
+
 
 def log(msg: str):
     """Print timestamped log message."""
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{ts}] {msg}")
+    # One write per line so lines from concurrent account workers don't interleave
+    sys.stdout.write(f"[{ts}] {msg}\n")
 
 
 def get_ssh_key_for_instance(instance: dict) -> Path:
@@ -64,37 +82,67 @@ def get_ssh_key_for_instance(instance: dict) -> Path:
     
     Falls back to SSH_KEY_DEFAULT if not found.
     """
-    ssh_key_names = instance.get("ssh_key_names", [])
-    if isinstance(ssh_key_names, str):
-        ssh_key_names = json.loads(ssh_key_names)
-    
-    # Try to find a matching key in the keys directory
-    if SSH_KEYS_DIR.exists():
-        for key_name in ssh_key_names:
-            # Structure 1: Direct file (./keys/chen-sabotage)
-            key_path = SSH_KEYS_DIR / key_name
-            if key_path.is_file():
-                return key_path
-            
-            # Structure 1 with extensions
-            for ext in [".pem", ".key"]:
-                key_path = SSH_KEYS_DIR / f"{key_name}{ext}"
-                if key_path.is_file():
-                    return key_path
+    index = get_key_index()
+    for key_name in instance.get("ssh_key_names", []):
+        key_path = index.get(key_name)
+        if key_path:
+            return key_path
+    
+    return SSH_KEY_DEFAULT
+
+
+# (SSH_KEYS_DIR mtime, {key name: key path}); rebuilt when the directory changes
+_key_index_cache: tuple[float, dict[str, Path]] | None = None
+
+
+def build_key_index() -> dict[str, Path]:
+    """
+    Scan SSH_KEYS_DIR once and map every key name to its key file.
+    Per name, the first match in this order wins (same as probing each path):
+        <name>, <name>.pem, <name>.key,
+        <name>/<name>.pem, <name>/<name>.key, <name>/<name>, <name>/*.pem
+    """
+    candidates: dict[str, list[tuple[int, str]]] = {}
+    
+    def add(name: str, priority: int, path: str):
+        candidates.setdefault(name, []).append((priority, path))
+    
+    with os.scandir(SSH_KEYS_DIR) as entries:
+        for entry in entries:
+            # Structure 1: Direct file (./keys/chen-sabotage, optionally .pem/.key)
+            if entry.is_file():
+                add(entry.name, 0, entry.path)
+                stem, ext = os.path.splitext(entry.name)
+                if ext in (".pem", ".key"):
+                    add(stem, 1 if ext == ".pem" else 2, entry.path)
             
             # Structure 2: Subfolder (./keys/chen-sabotage/chen-sabotage.pem)
-            key_dir = SSH_KEYS_DIR / key_name
-            if key_dir.is_dir():
-                for ext in [".pem", ".key", ""]:
-                    key_path = key_dir / f"{key_name}{ext}"
-                    if key_path.is_file():
-                        return key_path
-                # Also check for any .pem file in the subfolder
-                pem_files = list(key_dir.glob("*.pem"))
+            elif entry.is_dir():
+                name = entry.name
+                with os.scandir(entry.path) as sub_entries:
+                    files = {e.name: e.path for e in sub_entries if e.is_file()}
+                for priority, file_name in enumerate([f"{name}.pem", f"{name}.key", name], start=3):
+                    if file_name in files:
+                        add(name, priority, files[file_name])
+                # Also accept any .pem file in the subfolder
+                pem_files = sorted(f for f in files if f.endswith(".pem"))
                 if pem_files:
-                    return pem_files[0]
+                    add(name, 6, files[pem_files[0]])
     
-    return SSH_KEY_DEFAULT
+    return {name: Path(min(paths)[1]) for name, paths in candidates.items()}
+
+
+def get_key_index() -> dict[str, Path]:
+    """Return the key index, rescanning SSH_KEYS_DIR only if its mtime changed."""
+    global _key_index_cache
+    try:
+        mtime = SSH_KEYS_DIR.stat().st_mtime
+    except OSError:
+        return {}
+    
+    if _key_index_cache is None or _key_index_cache[0] != mtime:
+        _key_index_cache = (mtime, build_key_index())
+    return _key_index_cache[1]
 
 
 def ssh_command(ip: str, command: str, key_path: Path, timeout: int = 30) -> tuple[int, str]:
@@ -108,17 +156,25 @@ def ssh_command(ip: str, command: str, key_path: Path, timeout: int = 30) -> tup
         "-o", "UserKnownHostsFile=/dev/null",
         "-o", "ConnectTimeout=10",
         "-o", "BatchMode=yes",
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={SSH_CONTROL_PATH}",
+        "-o", f"ControlPersist={SSH_CONTROL_PERSIST}",
         "-i", str(key_path),
     ]
     
-    cmd = ["ssh"] + ssh_opts + [f"{SSH_USER}@{ip}", command]
+    cmd = [SSH_BIN] + ssh_opts + [f"{SSH_USER}@{ip}", command]
     
     try:
+        # stderr is discarded, not piped: a backgrounded ControlPersist master can
+        # hold it open, which would block reading it until the master exits
         result = subprocess.run(
             cmd,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
             text=True,
-            timeout=timeout
+            timeout=timeout,
+            env=SSH_ENV,
+            close_fds=False,
         )
         return result.returncode, result.stdout.strip()
     except subprocess.TimeoutExpired:
@@ -127,71 +183,205 @@ def ssh_command(ip: str, command: str, key_path: Path, timeout: int = 30) -> tup
         return -1, str(e)
 
 
-def get_gpu_utilization(instance: dict) -> list[int]:
-    """
-    Get GPU utilization percentages from a machine.
-    Returns list of utilization values (one per GPU), or empty list on failure.
+GPU_UTILIZATION_CMD = "nvidia-smi --query-gpu=utilization.gpu --format=csv,noheader,nounits"
+# Stats file kept up to date by gpu_agent.py; read it while fresh (< 1 minute old),
+# otherwise fall back to running nvidia-smi directly
+GPU_AGENT_STATS_PATH = "/tmp/heron_gpu_stats"
+GPU_STATS_CMD = (
+    f"if [ -n \"$(find {GPU_AGENT_STATS_PATH} -mmin -1 2>/dev/null)\" ]; "
+    f"then cat {GPU_AGENT_STATS_PATH}; else {GPU_UTILIZATION_CMD}; fi"
+)
+# Disk usage for relevant mount points (exclude tmpfs, devtmpfs, etc.)
+# Sizes come back in bytes; mount points are filtered in _parse_df (no grep/head on the host)
+STORAGE_USAGE_CMD = "df -B1 --output=target,size,used,avail,pcent 2>/dev/null"
+STORAGE_MOUNT_PREFIXES = ("/", "/home", "/lambda")
+STORAGE_MAX_MOUNTS = 10
+BYTES_PER_GB = 1024 ** 3
+
+# GPU and storage stats in one ssh session, each section introduced by a sentinel line
+GPU_SENTINEL = "==GPU=="
+DISK_SENTINEL = "==DISK=="
+HOST_STATS_CMD = (
+    f"printf '{GPU_SENTINEL}\\n'; {GPU_STATS_CMD}; "
+    f"printf '{DISK_SENTINEL}\\n'; {STORAGE_USAGE_CMD}"
+)
+
+
+def _parse_gpu(text: str) -> list[int]:
+    """Parse nvidia-smi output into utilization values. Raises ValueError on bad output."""
+    values = [int(line.strip()) for line in text.split("\n") if line.strip()]
+    if not values:
+        raise ValueError("no GPUs reported")
+    return values
+
+
+def _parse_df(text: str) -> list[dict]:
+    """Parse df output into storage dicts. Raises ValueError/IndexError on bad output."""
+    results = []
+    for line in text.split("\n"):
+        parts = line.split()
+        # Skips the header and pseudo filesystems not mounted under a path
+        if len(parts) < 5 or not parts[0].startswith(STORAGE_MOUNT_PREFIXES):
+            continue
+        
+        results.append({
+            "mount_point": parts[0],
+            "total_gb": int(parts[1]) / BYTES_PER_GB,
+            "used_gb": int(parts[2]) / BYTES_PER_GB,
+            "available_gb": int(parts[3]) / BYTES_PER_GB,
+            "use_percent": int(parts[4].rstrip('%')),
+        })
+        if len(results) == STORAGE_MAX_MOUNTS:
+            break
+    return results
+
+
+def parse_host_stats(ip: str, exit_code: int, output: str) -> tuple[list[int], list[dict]]:
     """
-    ip = instance.get("ip")
-    if not ip:
-        return []
-    
-    key_path = get_ssh_key_for_instance(instance)
-    cmd = "nvidia-smi --query-gpu=utilization.gpu --format=csv,noheader,nounits"
-    exit_code, output = ssh_command(ip, cmd, key_path)
+    Split HOST_STATS_CMD output on its sentinels and parse each section.
+    Returns (gpu_utils, storage_stats); a section that fails yields an empty list.
     
-    if exit_code != 0:
-        log(f"  Failed to get GPU stats from {ip}: {output}")
-        return []
+    A non-zero exit_code alone isn't fatal (one failing section still leaves the other's
+    output); it is only reported when the sentinels are missing.
+    """
+    _, sep, rest = output.partition(GPU_SENTINEL)
+    gpu_text, sep2, disk_text = rest.partition(DISK_SENTINEL)
+    if not sep or not sep2:
+        log(f"  Failed to get stats from {ip} (exit code {exit_code}): {output}")
+        return [], []
     
     try:
-        return [int(line.strip()) for line in output.split("\n") if line.strip()]
+        gpu_utils = _parse_gpu(gpu_text)
     except ValueError:
-        log(f"  Failed to parse GPU stats from {ip}: {output}")
-        return []
+        log(f"  Failed to parse GPU stats from {ip}: {gpu_text.strip()}")
+        gpu_utils = []
+    
+    try:
+        storage_stats = _parse_df(disk_text)
+    except (ValueError, IndexError) as e:
+        log(f"  Failed to parse storage stats from {ip}: {e}")
+        storage_stats = []
+    
+    return gpu_utils, storage_stats
 
 
-def get_storage_usage(instance: dict) -> list[dict]:
+def collect_host_stats(instance: dict) -> tuple[list[int], list[dict]]:
     """
-    Get disk storage usage from a machine.
-    Returns list of dicts with {mount_point, total_gb, used_gb, available_gb, use_percent}.
+    Get GPU utilization and disk usage from a machine over a single SSH session.
+    Returns (gpu_utils, storage_stats): one utilization value per GPU, and dicts
+    with {mount_point, total_gb, used_gb, available_gb, use_percent}.
     """
     ip = instance.get("ip")
     if not ip:
-        return []
+        return [], []
     
     key_path = get_ssh_key_for_instance(instance)
-    # Get disk usage for relevant mount points (exclude tmpfs, devtmpfs, etc.)
-    cmd = "df -BG --output=target,size,used,avail,pcent 2>/dev/null | grep -E '^(/|/home|/lambda)' | head -10"
-    exit_code, output = ssh_command(ip, cmd, key_path)
+    exit_code, output = ssh_command(ip, HOST_STATS_CMD, key_path)
+    return parse_host_stats(ip, exit_code, output)
+
+
+async def ssh_connect_async(instance: dict, semaphore: asyncio.Semaphore):
+    """
+    Open an asyncssh connection to a machine (same options as ssh_command).
+    Returns the connection, or None if the host is unreachable.
+    """
+    ip = instance["ip"]
+    async with semaphore:
+        try:
+            return await asyncssh.connect(
+                ip,
+                username=SSH_USER,
+                client_keys=[str(get_ssh_key_for_instance(instance))],
+                known_hosts=None,
+                connect_timeout=10,
+            )
+        except Exception as e:
+            log(f"  Failed to connect to {ip}: {e}")
+            return None
+
+
+async def ssh_command_async(conn, command: str, timeout: int = 30) -> tuple[int, str]:
+    """
+    Run a command over an open asyncssh connection.
+    Returns (exit_code, output).
+    """
+    try:
+        result = await asyncio.wait_for(conn.run(command, check=False), timeout)
+        return result.exit_status, (result.stdout or "").strip()
+    except asyncio.TimeoutError:
+        return -1, "timeout"
+    except Exception as e:
+        return -1, str(e)
+
+
+def poll_instance(instance: dict) -> tuple[list[int], list[dict]]:
+    """Collect (gpu_utils, storage_stats) from one machine. Never raises."""
+    try:
+        return collect_host_stats(instance)
+    except Exception as e:
+        log(f"  Failed to poll {instance.get('ip')}: {e}")
+        return [], []
+
+
+async def poll_instance_async(instance: dict, conn) -> tuple[list[int], list[dict]]:
+    """Async variant of poll_instance over an already-open connection (requires asyncssh)."""
+    ip = instance["ip"]
+    if conn is None:
+        return [], []
     
-    if exit_code != 0:
+    try:
+        return parse_host_stats(ip, *await ssh_command_async(conn, HOST_STATS_CMD))
+    except Exception as e:
+        log(f"  Failed to poll {ip}: {e}")
+        return [], []
+
+
+async def poll_instances_async(instances: list[dict]) -> list[tuple[list[int], list[dict]]]:
+    """
+    Open one connection per host (at most POLL_MAX_WORKERS handshakes at a time),
+    run every host's collector on it, and close all connections when done.
+    """
+    semaphore = asyncio.Semaphore(POLL_MAX_WORKERS)
+    conns: dict[str, object] = {}
+    try:
+        ips = list({inst["ip"] for inst in instances})
+        by_ip = {inst["ip"]: inst for inst in instances}
+        opened = await asyncio.gather(*(ssh_connect_async(by_ip[ip], semaphore) for ip in ips))
+        conns = dict(zip(ips, opened))
+        return await asyncio.gather(*(poll_instance_async(inst, conns[inst["ip"]]) for inst in instances))
+    finally:
+        for conn in conns.values():
+            if conn is not None:
+                conn.close()
+
+
+def poll_instances(instances: list[dict]) -> list[tuple[list[int], list[dict]]]:
+    """
+    Poll several machines concurrently; results are in the same order as instances.
+    Uses one asyncio event loop when asyncssh is installed, otherwise a thread
+    pool of ssh subprocesses.
+    """
+    if not instances:
         return []
     
-    results = []
-    try:
-        for line in output.split("\n"):
-            if not line.strip():
-                continue
-            parts = line.split()
-            if len(parts) >= 5:
-                mount_point = parts[0]
-                # Parse sizes (remove 'G' suffix)
-                total_gb = float(parts[1].rstrip('G'))
-                used_gb = float(parts[2].rstrip('G'))
-                available_gb = float(parts[3].rstrip('G'))
-                use_percent = int(parts[4].rstrip('%'))
-                results.append({
-                    "mount_point": mount_point,
-                    "total_gb": total_gb,
-                    "used_gb": used_gb,
-                    "available_gb": available_gb,
-                    "use_percent": use_percent,
-                })
-    except (ValueError, IndexError) as e:
-        log(f"  Failed to parse storage stats from {ip}: {e}")
+    if asyncssh is not None:
+        return asyncio.run(poll_instances_async(instances))
     
-    return results
+    with ThreadPoolExecutor(max_workers=min(POLL_MAX_WORKERS, len(instances))) as executor:
+        return list(executor.map(poll_instance, instances))
+
+
+def should_probe(conn, instance: dict) -> bool:
+    """Check whether an instance is due for a probe (skips hosts in failure backoff)."""
+    state = db.get_gpu_probe_state(conn, instance["id"])
+    if not state:
+        return True
+    
+    backoff = min(
+        GPU_PROBE_BACKOFF_MAX_SECONDS,
+        GPU_PROBE_BACKOFF_BASE_SECONDS * 2 ** state["failure_count"],
+    )
+    return time.time() > state["last_failure"] + backoff
 
 
 def initialize_machine(instance: dict) -> bool:
@@ -213,10 +403,14 @@ def initialize_machine(instance: dict) -> bool:
     log(f"Initializing machine {instance.get('name')} ({ip}) with key {key_path.name}...")
     
     # SCP options for all copy operations
+    # Reuse a master connection if one exists, but never start one from scp
+    # (its captured stderr would be held open by the backgrounded master)
     scp_opts = [
         "-F", "/dev/null",  # Ignore SSH config to avoid path issues
         "-o", "StrictHostKeyChecking=no",
         "-o", "UserKnownHostsFile=/dev/null",
+        "-o", "ControlMaster=no",
+        "-o", f"ControlPath={SSH_CONTROL_PATH}",
         "-i", str(key_path),
     ]
     
@@ -225,19 +419,22 @@ def initialize_machine(instance: dict) -> bool:
         (init_script, "/tmp/init_machine.sh"),
         (PROJECT_DIR / "data" / "public_keys.txt", "/tmp/public_keys.txt"),
         (PROJECT_DIR / "scripts" / "setup_ssh_keys.sh", "/tmp/setup_ssh_keys.sh"),
+        (PROJECT_DIR / "scripts" / "gpu_agent.py", "/tmp/heron_gpu_agent.py"),
     ]
     
     for local_path, remote_path in files_to_copy:
         if not local_path.exists():
-            # Skip optional files (public_keys.txt, setup_ssh_keys.sh)
+            # Skip optional files (public_keys.txt, setup_ssh_keys.sh, gpu_agent.py)
             if local_path.name != "init_machine.sh":
                 continue
             log(f"Required file not found: {local_path}")
             return False
         
-        scp_cmd = ["scp"] + scp_opts + [str(local_path), f"{SSH_USER}@{ip}:{remote_path}"]
+        scp_cmd = [SCP_BIN] + scp_opts + [str(local_path), f"{SSH_USER}@{ip}:{remote_path}"]
         try:
-            result = subprocess.run(scp_cmd, capture_output=True, text=True, timeout=60)
+            result = subprocess.run(
+                scp_cmd, capture_output=True, text=True, timeout=60, env=SSH_ENV, close_fds=False
+            )
             if result.returncode != 0:
                 log(f"Failed to copy {local_path.name}: {result.stderr}")
                 return False
@@ -256,6 +453,24 @@ def initialize_machine(instance: dict) -> bool:
     return True
 
 
+# One Host entry in the managed section of ~/.ssh/config
+SSH_HOST_TEMPLATE = (
+    "Host {name}\n"
+    "    HostName {ip}\n"
+    "    User {user}\n"
+    '    IdentityFile "{key}"\n'
+    "    StrictHostKeyChecking no\n"
+    "    UserKnownHostsFile /dev/null\n"
+    "    ControlMaster auto\n"
+    "    ControlPath {control_path}\n"
+    "    ControlPersist {control_persist}\n"
+    "    # Instance ID: {iid}\n"
+    "    # Account: {account}\n"
+    "    # Type: {itype}\n"
+    "\n"
+)
+
+
 def update_ssh_config(instances: list[dict]):
     """Update SSH config with current Lambda instances."""
     # Read existing config
@@ -267,16 +482,23 @@ def update_ssh_config(instances: list[dict]):
     marker_start = "# BEGIN LAMBDA-MANAGED"
     marker_end = "# END LAMBDA-MANAGED"
     
+    old_hosts = None
     if marker_start in existing_content:
-        before = existing_content.split(marker_start)[0].rstrip()
-        after_parts = existing_content.split(marker_end)
+        before, old_section = existing_content.split(marker_start, 1)
+        before = before.rstrip()
+        # Host blocks follow the header's blank line (skips the "# Updated:" stamp)
+        old_header_and_hosts = old_section.split(marker_end, 1)[0].split("\n\n", 1)
+        old_hosts = old_header_and_hosts[1] if len(old_header_and_hosts) > 1 else ""
+        after_parts = existing_content.split(marker_end, 1)
         after = after_parts[1].lstrip() if len(after_parts) > 1 else ""
         existing_content = before + ("\n\n" if before and after else "\n" if before else "") + after
     
     # Generate new Lambda section
-    lambda_section = f"{marker_start}\n"
-    lambda_section += "# Auto-generated by heron-infra monitor.py\n"
-    lambda_section += f"# Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    parts = [
+        f"{marker_start}\n",
+        "# Auto-generated by heron-infra monitor.py\n",
+        f"# Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n",
+    ]
     
     for inst in instances:
         if inst.get("status") != "active" or not inst.get("ip"):
@@ -294,18 +516,27 @@ def update_ssh_config(instances: list[dict]):
         # Get the right SSH key for this instance
         key_path = get_ssh_key_for_instance(inst)
         
-        lambda_section += f"Host {host_name}\n"
-        lambda_section += f"    HostName {inst['ip']}\n"
-        lambda_section += f"    User {SSH_USER}\n"
-        lambda_section += f'    IdentityFile "{key_path}"\n'
-        lambda_section += f"    StrictHostKeyChecking no\n"
-        lambda_section += f"    UserKnownHostsFile /dev/null\n"
-        lambda_section += f"    # Instance ID: {inst['id']}\n"
-        lambda_section += f"    # Account: {account or 'default'}\n"
-        lambda_section += f"    # Type: {inst.get('instance_type', 'unknown')}\n"
-        lambda_section += "\n"
-    
-    lambda_section += marker_end
+        parts.append(SSH_HOST_TEMPLATE.format(
+            name=host_name,
+            ip=inst["ip"],
+            user=SSH_USER,
+            key=key_path,
+            control_path=SSH_CONTROL_PATH,
+            control_persist=SSH_CONTROL_PERSIST,
+            iid=inst["id"],
+            account=account or "default",
+            itype=inst.get("instance_type", "unknown"),
+        ))
+    
+    num_active = len([i for i in instances if i.get("status") == "active"])
+    
+    # Same hosts as last run: leave the file (and its "Updated" stamp) alone
+    if old_hosts == "".join(parts[3:]):
+        log(f"SSH config unchanged ({num_active} instances)")
+        return
+    
+    parts.append(marker_end)
+    lambda_section = "".join(parts)
     
     # Write updated config
     SSH_CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
@@ -315,15 +546,25 @@ def update_ssh_config(instances: list[dict]):
     else:
         new_content = lambda_section
     
-    SSH_CONFIG_PATH.write_text(new_content)
-    SSH_CONFIG_PATH.chmod(0o600)
-    log(f"Updated SSH config with {len([i for i in instances if i.get('status') == 'active'])} instances")
+    # Write to a temp file and rename over the config, so a crash never leaves it truncated.
+    # Rename over the symlink's target (e.g. a dotfiles checkout), not the link itself
+    target = SSH_CONFIG_PATH.resolve()
+    tmp_path = target.with_name(target.name + ".tmp")
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(new_content)
+        os.replace(tmp_path, target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    log(f"Updated SSH config with {num_active} instances")
 
 
 def update_costs(conn, instances: list[dict], account: str):
     """Update cost tracking for the account."""
     # Cost per minute = hourly_cost / 60
     total_cost_per_minute = 0
+    key_costs = []
     
     for inst in instances:
         if inst.get("status") != "active":
@@ -338,15 +579,12 @@ def update_costs(conn, instances: list[dict], account: str):
         
         # Also track per-SSH-key for backward compatibility
         ssh_keys = inst.get("ssh_key_names")
-        if isinstance(ssh_keys, str):
-            ssh_keys = json.loads(ssh_keys)
-        
         if ssh_keys:
-            db.update_cost(conn, ssh_keys[0], int(cost_per_minute))
+            key_costs.append((ssh_keys[0], int(cost_per_minute)))
     
-    # Update account cost
-    if total_cost_per_minute > 0:
-        db.update_account_cost(conn, account, int(total_cost_per_minute))
+    # Per-key and account costs land in one transaction
+    if key_costs or total_cost_per_minute > 0:
+        db.update_costs_bulk(conn, key_costs, account, int(total_cost_per_minute))
 
 
 def process_account(conn, account: dict) -> list[dict]:
@@ -381,28 +619,40 @@ def process_account(conn, account: dict) -> list[dict]:
                 db.mark_initialized(conn, inst["id"])
     
     # Get GPU and storage stats for active instances (may fail if SSH unavailable)
+    to_probe = []
     for inst in active:
         if not inst.get("ip"):
             continue
         
+        # Don't burn the cron budget re-timing-out on a host that just failed
+        if not should_probe(conn, inst):
+            name = inst.get("name") or inst.get("hostname") or inst["id"][:8]
+            log(f"  {name}: Skipping (unreachable, backing off)")
+            continue
+        
+        to_probe.append(inst)
+    
+    # SSH to all hosts concurrently; DB writes stay on this thread
+    gpu_rows = []
+    storage_rows = []
+    for inst, (gpu_utils, storage_stats) in zip(to_probe, poll_instances(to_probe)):
         name = inst.get("name") or inst.get("hostname") or inst["id"][:8]
         
         # GPU utilization
-        gpu_utils = get_gpu_utilization(inst)
+        db.record_gpu_probe_result(conn, inst["id"], ok=bool(gpu_utils))
         for gpu_idx, util in enumerate(gpu_utils):
-            db.add_gpu_sample(conn, inst["id"], util, gpu_idx)
+            gpu_rows.append((inst["id"], util, gpu_idx))
         
         # Storage utilization
-        storage_stats = get_storage_usage(inst)
         for storage in storage_stats:
-            db.add_storage_sample(
-                conn, inst["id"], 
+            storage_rows.append((
+                inst["id"],
                 storage["mount_point"],
                 storage["total_gb"],
                 storage["used_gb"],
                 storage["available_gb"],
-                storage["use_percent"]
-            )
+                storage["use_percent"],
+            ))
         
         # Log summary
         if gpu_utils or storage_stats:
@@ -415,12 +665,33 @@ def process_account(conn, account: dict) -> list[dict]:
                     parts.append(f"Disk={root_storage['use_percent']}%")
             log(f"  {name}: {', '.join(parts)}")
     
+    # One transaction per table for the whole account
+    db.add_gpu_samples_bulk(conn, gpu_rows)
+    db.add_storage_samples_bulk(conn, storage_rows)
+    
+    return active
+
+
+def run_account(account: dict) -> list[dict]:
+    """Process one account on its own DB connection (safe to call from a worker thread)."""
+    conn = db.get_db()
+    try:
+        active = process_account(conn, account)
+    finally:
+        conn.close()
+    
+    # Add account info to instances for SSH config
+    for inst in active:
+        inst["account"] = account["name"]
     return active
 
 
 def main():
     log("Starting monitor run...")
     
+    # ssh/scp (and hosts in the generated SSH config) put their control sockets here
+    SSH_CONTROL_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    
     # Load accounts
     accounts_data = utils_accounts.load_accounts()
     accounts = utils_accounts.get_account_list(accounts_data)
@@ -434,16 +705,14 @@ def main():
     try:
         all_active_instances = []
         
-        # Process each account
-        for account in accounts:
-            try:
-                active = process_account(conn, account)
-                # Add account info to instances for SSH config
-                for inst in active:
-                    inst["account"] = account["name"]
-                all_active_instances.extend(active)
-            except Exception as e:
-                log(f"Error processing account {account['name']}: {e}")
+        # Process accounts concurrently (API calls and SSH fleets are independent)
+        with ThreadPoolExecutor(max_workers=min(ACCOUNT_MAX_WORKERS, len(accounts))) as executor:
+            futures = [executor.submit(run_account, account) for account in accounts]
+            for account, future in zip(accounts, futures):
+                try:
+                    all_active_instances.extend(future.result())
+                except Exception as e:
+                    log(f"Error processing account {account['name']}: {e}")
         
         # Update SSH config with instances from all accounts
         update_ssh_config(all_active_instances)
@@ -451,8 +720,11 @@ def main():
         # Export to JSON for inspection
         db.export_to_json(conn)
         
-        # Cleanup old samples (keep 24 hours)
-        db.cleanup_old_samples(conn, older_than_hours=24)
+        # Cleanup old samples (keep 24 hours) and probe failures of hosts no longer polled
+        # (a polled host's record is refreshed at least every GPU_PROBE_BACKOFF_MAX_SECONDS)
+        db.cleanup_old_samples(
+            conn, older_than_hours=24, probe_state_older_than_seconds=2 * GPU_PROBE_BACKOFF_MAX_SECONDS
+        )
         
         log(f"Monitor run complete ({len(accounts)} accounts, {len(all_active_instances)} instances)")
         
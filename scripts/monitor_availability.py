@@ -4,9 +4,9 @@ Check and track Lambda instance type availability by region.
 Run periodically to build up historical data on availability patterns.
 """
 
+import functools
 import json
 import time
-from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
 
@@ -41,10 +41,15 @@ def get_api_key() -> str:
     return first_account["api_key"]
 
 
+@functools.lru_cache(maxsize=1)
+def get_instance_types() -> dict:
+    """Fetch instance types from the API once per process (--record and the live view share it)."""
+    return lambda_api.list_instance_types(get_api_key())
+
+
 def fetch_and_record_availability(conn):
     """Fetch current availability and record to database."""
-    api_key = get_api_key()
-    types = lambda_api.list_instance_types(api_key)
+    types = get_instance_types()
     
     recorded = 0
     for type_name, data in types.items():
@@ -58,8 +63,7 @@ def fetch_and_record_availability(conn):
 
 def get_current_availability():
     """Get current availability (live from API)."""
-    api_key = get_api_key()
-    types = lambda_api.list_instance_types(api_key)
+    types = get_instance_types()
     
     # Group by availability
     available = {}
@@ -87,34 +91,18 @@ def get_current_availability():
 
 def analyze_history(conn, hours: int = 24):
     """Analyze availability history to find patterns."""
-    history = db.get_availability_history(conn, hours)
-    
-    if not history:
-        return {}
-    
-    # Count availability per (type, region) pair
-    counts = defaultdict(lambda: defaultdict(int))
-    total_checks = defaultdict(int)
-    
-    # Group by approximate time slots (every 10 minutes)
-    time_slots = defaultdict(set)
-    for record in history:
-        slot = int(record["timestamp"] // 600)  # 10-minute slots
-        time_slots[slot].add(record["timestamp"])
-        counts[record["instance_type"]][record["region"]] += 1
+    rows, num_checks = db.aggregate_availability(conn, hours)
     
-    num_checks = len(time_slots)
+    if not rows:
+        return {}, 0
     
     # Calculate availability percentage
     results = {}
-    for itype, regions in counts.items():
-        results[itype] = {
-            region: {
-                "count": count,
-                "checks": num_checks,
-                "pct": round(100 * count / num_checks, 1) if num_checks > 0 else 0
-            }
-            for region, count in regions.items()
+    for itype, region, count in rows:
+        results.setdefault(itype, {})[region] = {
+            "count": count,
+            "checks": num_checks,
+            "pct": round(100 * count / num_checks, 1),
         }
     
     return results, num_checks
@@ -155,16 +143,14 @@ def print_history_analysis(analysis, num_checks, hours):
     
     print(f"\n  Availability History  │  Last {hours} hours  │  {num_checks} checks\n")
     
-    # Sort by most frequently available
-    sorted_types = sorted(
-        analysis.items(),
-        key=lambda x: max(r["pct"] for r in x[1].values()),
-        reverse=True
-    )
+    # Sort by most frequently available (best region's pct computed once per type)
+    ranked = [(itype, max(r["pct"] for r in regions.values()), regions) for itype, regions in analysis.items()]
+    ranked.sort(key=lambda x: x[1], reverse=True)
     
-    for itype, regions in sorted_types:
-        sorted_regions = sorted(regions.items(), key=lambda x: x[1]["pct"], reverse=True)
-        region_strs = [f"{r}: {data['pct']}%" for r, data in sorted_regions]
+    for itype, _, regions in ranked:
+        sorted_regions = [(region, data["pct"]) for region, data in regions.items()]
+        sorted_regions.sort(key=lambda x: x[1], reverse=True)
+        region_strs = [f"{region}: {pct}%" for region, pct in sorted_regions]
         print(f"  {itype:<28} │ {', '.join(region_strs)}")
     
     print()
@@ -4,9 +4,10 @@ Show GPU availability patterns by region, day of week, and time block.
 Analyzes historical data collected by monitor_availability.py.
 """
 
+import heapq
 import json
+import sys
 import time
-from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
 
@@ -27,15 +28,17 @@ TIME_BLOCKS = [
     ("20-24", 20, 24),
 ]
 
+# Fixed table chrome for print_region_table (each day column is 6 chars + separator)
+TABLE_DAY_HEADER = "  │ GPU Type                │" + "".join(f" {day}  │" for day in DAYS)
+TABLE_BLOCK_HEADER = "  │                         │" + "012345│" * len(DAYS)
+TABLE_MID_RULE = "  ├─────────────────────────┼" + "──────┼" * len(DAYS)
+TABLE_BOTTOM_RULE = "  └─────────────────────────┴" + "──────┴" * len(DAYS)
 
-def get_block_index(hour: int) -> int:
-    """Get the time block index (0-5) for a given hour."""
-    return hour // 4
 
-
-def analyze_availability_patterns(conn, days: int = 7) -> dict:
+def analyze_availability_patterns(conn, days: int = 7, region_like: str = None, gpu_like: str = None) -> dict:
     """
-    Analyze availability data to find patterns by day/time.
+    Analyze availability data to find patterns by day/time, optionally keeping only
+    regions / GPU types containing region_like / gpu_like (case-insensitive).
     
     Returns:
         (results, total_checks, checks_per_slot) where results is:
@@ -51,89 +54,56 @@ def analyze_availability_patterns(conn, days: int = 7) -> dict:
             }
         }
     """
-    history = db.get_availability_history(conn, hours=days * 24)
+    counts, checks = db.get_availability_counts(conn, hours=days * 24, region_like=region_like, gpu_like=gpu_like)
     
-    if not history:
+    if not checks:
         return {}, 0, {}
     
-    # Track when we had data (to know total possible checks per slot)
-    check_times = set()
-    
-    # Count availability per (region, type, day, block)
-    # Structure: region -> type -> (day, block) -> count
-    availability = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    
-    for record in history:
-        ts = record["timestamp"]
-        dt = datetime.fromtimestamp(ts)
-        day_idx = dt.weekday()  # 0=Monday
-        block_idx = get_block_index(dt.hour)
-        
-        # Round to 10-minute slot for counting unique checks
-        slot = int(ts // 600)
-        check_times.add((slot, day_idx, block_idx))
-        
-        region = record["region"]
-        itype = record["instance_type"]
-        availability[region][itype][(day_idx, block_idx)] += 1
-    
-    # Count checks per (day, block)
-    checks_per_slot = defaultdict(int)
-    for _, day_idx, block_idx in check_times:
-        checks_per_slot[(day_idx, block_idx)] += 1
+    # Unique 10-minute checks per (day, block), to know total possible checks per slot
+    checks_per_slot = {(day_idx, block_idx): n for day_idx, block_idx, n in checks}
     
     # Calculate percentages
     results = {}
-    for region, types in availability.items():
-        results[region] = {}
-        for itype, slots in types.items():
-            results[region][itype] = {}
-            for (day_idx, block_idx), count in slots.items():
-                total = checks_per_slot[(day_idx, block_idx)]
-                pct = round(100 * count / total, 1) if total > 0 else 0
-                results[region][itype][(day_idx, block_idx)] = {
-                    "available_count": count,
-                    "total_checks": total,
-                    "pct": pct
-                }
+    for region, itype, day_idx, block_idx, count in counts:
+        total = checks_per_slot.get((day_idx, block_idx), 0)
+        pct = round(100 * count / total, 1) if total > 0 else 0
+        results.setdefault(region, {}).setdefault(itype, {})[(day_idx, block_idx)] = {
+            "available_count": count,
+            "total_checks": total,
+            "pct": pct
+        }
     
-    return results, len(check_times), dict(checks_per_slot)
+    return results, sum(checks_per_slot.values()), checks_per_slot
+
+
+# Indicator per 5% bucket of a (non-zero) pct: index = min(20, int(pct) // 5)
+#   · >0%, ░ ≥20%, ▒ ≥40%, ▓ ≥60%, █ ≥80%
+INDICATORS = ["·"] * 4 + ["░"] * 4 + ["▒"] * 4 + ["▓"] * 4 + ["█"] * 5
+COLOR_INDICATORS = (
+    ["\033[90m·\033[0m"] * 4     # Gray - Rare
+    + ["\033[91m░\033[0m"] * 4   # Red - Low
+    + ["\033[33m▒\033[0m"] * 4   # Orange - Medium
+    + ["\033[93m▓\033[0m"] * 4   # Yellow - High
+    + ["\033[92m█\033[0m"] * 5   # Green - Very high
+)
 
 
 def pct_to_indicator(pct: float, has_data: bool = True) -> str:
     """Convert availability percentage to a visual indicator."""
     if not has_data:
         return "-"  # No data collected for this time slot
-    if pct >= 80:
-        return "█"  # Very high
-    elif pct >= 60:
-        return "▓"  # High
-    elif pct >= 40:
-        return "▒"  # Medium
-    elif pct >= 20:
-        return "░"  # Low
-    elif pct > 0:
-        return "·"  # Rare
-    else:
+    if pct <= 0:
         return "×"  # Checked but never available
+    return INDICATORS[min(20, int(pct) // 5)]
 
 
 def pct_to_color_indicator(pct: float, has_data: bool = True) -> str:
     """Convert availability percentage to colored indicator (with ANSI)."""
     if not has_data:
         return "\033[90m-\033[0m"  # Dark gray - No data collected
-    if pct >= 80:
-        return "\033[92m█\033[0m"  # Green - Very high
-    elif pct >= 60:
-        return "\033[93m▓\033[0m"  # Yellow - High
-    elif pct >= 40:
-        return "\033[33m▒\033[0m"  # Orange - Medium
-    elif pct >= 20:
-        return "\033[91m░\033[0m"  # Red - Low
-    elif pct > 0:
-        return "\033[90m·\033[0m"  # Gray - Rare
-    else:
+    if pct <= 0:
         return "\033[31m×\033[0m"  # Red × - Checked but never available
+    return COLOR_INDICATORS[min(20, int(pct) // 5)]
 
 
 def print_region_table(region: str, types_data: dict, checks_per_slot: dict, use_color: bool = True):
@@ -146,19 +116,17 @@ def print_region_table(region: str, types_data: dict, checks_per_slot: dict, use
     # Header
     print(f"\n  ┌─ {region} {'─' * (71 - len(region))}┐")
     
-    # Column headers: days across top (each day column is 7 chars including separator)
-    header = "  │ GPU Type                │"
-    for day in DAYS:
-        header += f" {day}  │"  # 6 chars + separator = 7 total
-    print(header)
-    
-    # Subheader: time blocks (6 chars + separator = 7 total per day)
-    subheader = "  │                         │"
-    for _ in DAYS:
-        subheader += "012345│"
-    print(subheader)
+    # Column headers: days across top, time blocks underneath
+    print(TABLE_DAY_HEADER)
+    print(TABLE_BLOCK_HEADER)
+    print(TABLE_MID_RULE)
     
-    print(f"  ├─────────────────────────┼" + "──────┼" * 7)
+    # Which (day, block) slots were checked at all is the same for every GPU type row
+    day_slots = [
+        [((day_idx, block_idx), checks_per_slot.get((day_idx, block_idx), 0) > 0) for block_idx in range(6)]
+        for day_idx in range(7)
+    ]
+    empty = {}
     
     # Sort GPU types by name
     sorted_types = sorted(types_data.keys())
@@ -168,51 +136,49 @@ def print_region_table(region: str, types_data: dict, checks_per_slot: dict, use
         
         # Shorten type name if needed
         display_name = itype[:23] if len(itype) <= 23 else itype[:20] + "..."
-        row = f"  │ {display_name:<23} │"
+        parts = [f"  │ {display_name:<23} │"]
         
-        for day_idx in range(7):
-            day_cells = ""
-            for block_idx in range(6):
-                has_data = checks_per_slot.get((day_idx, block_idx), 0) > 0
-                data = slots.get((day_idx, block_idx), {})
-                pct = data.get("pct", 0)
-                day_cells += indicator_fn(pct, has_data)
-            row += f"{day_cells}│"
+        for day in day_slots:
+            for slot, has_data in day:
+                parts.append(indicator_fn(slots.get(slot, empty).get("pct", 0), has_data))
+            parts.append("│")
         
-        print(row)
+        print("".join(parts))
     
-    print(f"  └─────────────────────────┴" + "──────┴" * 7)
+    print(TABLE_BOTTOM_RULE)
 
 
 def print_legend(use_color: bool = True):
     """Print the legend explaining the symbols."""
-    print("\n  Legend: ", end="")
     if use_color:
-        print("\033[92m█\033[0m ≥80%  ", end="")
-        print("\033[93m▓\033[0m ≥60%  ", end="")
-        print("\033[33m▒\033[0m ≥40%  ", end="")
-        print("\033[91m░\033[0m ≥20%  ", end="")
-        print("\033[90m·\033[0m >0%  ", end="")
-        print("\033[31m×\033[0m never  ", end="")
-        print("\033[90m-\033[0m no data", end="")
+        entries = [
+            "\033[92m█\033[0m ≥80%  ",
+            "\033[93m▓\033[0m ≥60%  ",
+            "\033[33m▒\033[0m ≥40%  ",
+            "\033[91m░\033[0m ≥20%  ",
+            "\033[90m·\033[0m >0%  ",
+            "\033[31m×\033[0m never  ",
+            "\033[90m-\033[0m no data",
+        ]
     else:
-        print("█ ≥80%  ▓ ≥60%  ▒ ≥40%  ░ ≥20%  · >0%  × never  - no data", end="")
-    print()
+        entries = ["█ ≥80%  ▓ ≥60%  ▒ ≥40%  ░ ≥20%  · >0%  × never  - no data"]
+    print("\n  Legend: " + "".join(entries))
     print("  Time blocks: 0=00-04, 1=04-08, 2=08-12, 3=12-16, 4=16-20, 5=20-24 (UTC)\n")
 
 
 def print_summary_by_gpu(data: dict, use_color: bool = True):
     """Print a summary showing best times for each GPU type across all regions."""
-    # Aggregate across regions
-    type_summary = defaultdict(lambda: defaultdict(list))
+    # Aggregate across regions in one flat pass: itype -> {(day, block): (best pct, region)}
+    type_summary = {}
     
     for region, types in data.items():
         for itype, slots in types.items():
-            for (day_idx, block_idx), info in slots.items():
-                type_summary[itype][(day_idx, block_idx)].append({
-                    "region": region,
-                    "pct": info["pct"]
-                })
+            best_by_slot = type_summary.setdefault(itype, {})
+            for slot, info in slots.items():
+                pct = info["pct"]
+                best = best_by_slot.get(slot)
+                if best is None or pct > best[0]:
+                    best_by_slot[slot] = (pct, region)
     
     if not type_summary:
         return
@@ -221,30 +187,19 @@ def print_summary_by_gpu(data: dict, use_color: bool = True):
     print("  │                                                                   │")
     
     for itype in sorted(type_summary.keys()):
-        slots = type_summary[itype]
-        
-        # Find best slots (highest availability)
-        best_slots = []
-        for (day_idx, block_idx), regions_data in slots.items():
-            max_pct = max(r["pct"] for r in regions_data)
-            best_region = max(regions_data, key=lambda r: r["pct"])["region"]
-            if max_pct > 0:
-                best_slots.append({
-                    "day": DAYS[day_idx],
-                    "block": TIME_BLOCKS[block_idx][0],
-                    "pct": max_pct,
-                    "region": best_region
-                })
-        
-        if not best_slots:
+        # Top 3 slots by best pct (slots never available anywhere are skipped)
+        top_slots = heapq.nlargest(
+            3,
+            ((slot, pct) for slot, (pct, _) in type_summary[itype].items() if pct > 0),
+            key=lambda x: x[1],
+        )
+        if not top_slots:
             continue
         
-        # Sort by pct descending, take top 3
-        best_slots.sort(key=lambda x: x["pct"], reverse=True)
-        top_slots = best_slots[:3]
-        
         display_name = itype[:25] if len(itype) <= 25 else itype[:22] + "..."
-        slots_str = ", ".join(f"{s['day']} {s['block']} ({s['pct']:.0f}%)" for s in top_slots)
+        slots_str = ", ".join(
+            f"{DAYS[day_idx]} {TIME_BLOCKS[block_idx][0]} ({pct:.0f}%)" for (day_idx, block_idx), pct in top_slots
+        )
         
         print(f"  │ {display_name:<25} {slots_str:<39}│")
     
@@ -254,14 +209,17 @@ def print_summary_by_gpu(data: dict, use_color: bool = True):
 
 def print_summary_by_time(data: dict, use_color: bool = True):
     """Print a summary showing best GPUs available at each time of day (aggregated across all days)."""
-    # Aggregate: block_idx -> {gpu_type: [pct values across days]}
-    time_summary = defaultdict(lambda: defaultdict(list))
+    # Aggregate: block_idx -> {gpu_type: [sum of pct, count]} across days and regions
+    time_summary = {}
     
     for region, types in data.items():
         for itype, slots in types.items():
             for (day_idx, block_idx), info in slots.items():
-                if info["pct"] > 0:
-                    time_summary[block_idx][itype].append(info["pct"])
+                pct = info["pct"]
+                if pct > 0:
+                    totals = time_summary.setdefault(block_idx, {}).setdefault(itype, [0, 0])
+                    totals[0] += pct
+                    totals[1] += 1
     
     if not time_summary:
         return
@@ -276,13 +234,9 @@ def print_summary_by_time(data: dict, use_color: bool = True):
             print(f"  │ {time_label:<8} (no data)                                          │")
             continue
         
-        # Calculate average pct for each GPU across all days
-        gpu_avgs = {}
-        for gpu, pcts in gpu_data.items():
-            gpu_avgs[gpu] = sum(pcts) / len(pcts)
-        
-        # Sort by avg pct descending, take top 4
-        sorted_gpus = sorted(gpu_avgs.items(), key=lambda x: x[1], reverse=True)[:4]
+        # Top 4 by average pct across all days
+        gpu_avgs = ((gpu, total / count) for gpu, (total, count) in gpu_data.items())
+        sorted_gpus = heapq.nlargest(4, gpu_avgs, key=lambda x: x[1])
         
         time_label = TIME_BLOCKS[block_idx][0]
         gpus_str = ", ".join(f"{gpu.replace('gpu_', '')} ({pct:.0f}%)" for gpu, pct in sorted_gpus)
@@ -308,32 +262,26 @@ def main():
     parser.add_argument("--by-gpu", action="store_true", help="Show best times per GPU (default in summary)")
     parser.add_argument("--by-time", action="store_true", help="Show best GPUs per time slot")
     parser.add_argument("--json", action="store_true", help="Output as JSON")
+    parser.add_argument("--pretty", action="store_true", help="Indent JSON output (default: compact)")
     args = parser.parse_args()
     
     use_color = not args.no_color
     
     conn = db.get_db()
+    db.begin_read(conn)
     
     try:
-        data, total_checks, checks_per_slot = analyze_availability_patterns(conn, args.days)
+        # Region / GPU type filters are applied in the query
+        data, total_checks, checks_per_slot = analyze_availability_patterns(
+            conn, args.days, region_like=args.region, gpu_like=args.gpu
+        )
         
-        if not data:
+        if not total_checks:
             print(f"\n  No availability data found for the last {args.days} days.")
             print("  Run: python3 monitor_availability.py --record")
             print("  Or wait for cron to collect data.\n")
             return
         
-        # Filter by region if specified
-        if args.region:
-            data = {k: v for k, v in data.items() if args.region.lower() in k.lower()}
-        
-        # Filter by GPU type if specified
-        if args.gpu:
-            for region in data:
-                data[region] = {k: v for k, v in data[region].items() if args.gpu.lower() in k.lower()}
-            # Remove empty regions
-            data = {k: v for k, v in data.items() if v}
-        
         if not data:
             print(f"\n  No matching data found for filters.")
             return
@@ -348,7 +296,10 @@ def main():
                         f"{DAYS[d]}_{TIME_BLOCKS[b][0]}": info
                         for (d, b), info in slots.items()
                     }
-            print(json.dumps(json_data, indent=2))
+            if args.pretty:
+                print(json.dumps(json_data, indent=2))
+            else:
+                sys.stdout.write(json.dumps(json_data, separators=(",", ":")) + "\n")
             return
         
         # Print header
@@ -377,6 +328,7 @@ def main():
                 print_summary_by_gpu(data, use_color)
         
     finally:
+        conn.commit()
         conn.close()
 
 
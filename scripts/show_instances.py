@@ -4,41 +4,40 @@ Check status of Lambda instances: GPU usage, idle time, time until termination.
 Supports multiple Lambda Labs accounts.
 """
 
+import bisect
+import functools
+import itertools
 import json
+import operator
+import sys
 import time
 from datetime import datetime
-from pathlib import Path
 
 import utils_accounts
+import utils_config
 import utils_db as db
+import utils_idle
 
-PROJECT_DIR = Path(__file__).parent.parent
-
-
-def load_config():
-    config_path = PROJECT_DIR / "config.env"
-    config = {}
-    if config_path.exists():
-        with open(config_path) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    config[key.strip()] = value.strip()
-    return config
-
-
-CONFIG = load_config()
-MIN_RUNTIME_HOURS = float(CONFIG.get("MIN_RUNTIME_HOURS", "4"))
-IDLE_SHUTDOWN_HOURS = float(CONFIG.get("IDLE_SHUTDOWN_HOURS", "2"))
+CONFIG = utils_config.CONFIG
+MIN_RUNTIME_HOURS = utils_idle.MIN_RUNTIME_HOURS
+IDLE_SHUTDOWN_HOURS = utils_idle.IDLE_SHUTDOWN_HOURS
 DEFAULT_BUDGET_LIMIT = int(CONFIG.get("BUDGET_LIMIT_DEFAULT", "500000"))
 
+# Inner width of the per-instance status box
+BOX_WIDTH = 72
+BOX_BOTTOM = f"└{'─' * BOX_WIDTH}┘"
+
 
 def format_duration(hours: float) -> str:
     """Format duration in hours to human-readable string."""
     if hours is None or hours < 0:
         return "-"
-    total_minutes = int(hours * 60)
+    return _format_minutes(int(hours * 60))
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_minutes(total_minutes: int) -> str:
+    """Cached by whole minute (the format only shows minutes)."""
     h, m = divmod(total_minutes, 60)
     return f"{h}h{m:02d}m" if h > 0 else f"{m}m"
 
@@ -47,72 +46,39 @@ def format_timestamp(ts: float | None) -> str:
     """Format timestamp to readable string."""
     if ts is None:
         return "-"
+    return _format_timestamp(int(ts))
+
+
+@functools.lru_cache(maxsize=8192)
+def _format_timestamp(ts: int) -> str:
+    """Cached by whole second (the format only shows minutes)."""
     return datetime.fromtimestamp(ts).strftime("%b %d %H:%M")
 
 
+@functools.lru_cache(maxsize=4096)
 def format_cost(cents: int) -> str:
     """Format cents to dollar string."""
     return f"${cents / 100:.2f}"
 
 
-def group_samples_by_timestamp(samples: list[dict], tolerance: float = 30.0) -> list[dict]:
+def get_instance_stats(
+    instance: dict, samples_24h: list[dict], last_active: float | None, storage: list[dict], now: float
+) -> dict:
     """
-    Group samples by timestamp (within tolerance seconds) and average across GPUs.
-    Returns list of {timestamp, avg_utilization, all_zero, gpu_count}.
+    Get GPU usage stats for an instance (handles multi-GPU).
+    samples_24h are the instance's GPU samples from the 24 hours before now, last_active the
+    timestamp of its latest non-zero sample in that window (None if all zero) and storage its
+    latest storage sample per mount; every cutoff is taken relative to that same now.
     """
-    if not samples:
-        return []
-    
-    # Sort by timestamp
-    sorted_samples = sorted(samples, key=lambda s: s["timestamp"])
-    
-    grouped = []
-    current_group = [sorted_samples[0]]
-    
-    for sample in sorted_samples[1:]:
-        if sample["timestamp"] - current_group[0]["timestamp"] <= tolerance:
-            current_group.append(sample)
-        else:
-            # Finalize current group
-            utils = [s["utilization"] for s in current_group]
-            grouped.append({
-                "timestamp": current_group[0]["timestamp"],
-                "avg_utilization": sum(utils) / len(utils),
-                "all_zero": all(u == 0 for u in utils),
-                "gpu_count": len(current_group),
-            })
-            current_group = [sample]
-    
-    # Don't forget last group
-    if current_group:
-        utils = [s["utilization"] for s in current_group]
-        grouped.append({
-            "timestamp": current_group[0]["timestamp"],
-            "avg_utilization": sum(utils) / len(utils),
-            "all_zero": all(u == 0 for u in utils),
-            "gpu_count": len(current_group),
-        })
-    
-    return grouped
-
-
-def get_instance_stats(conn, instance: dict) -> dict:
-    """Get GPU usage stats for an instance (handles multi-GPU)."""
-    instance_id = instance["id"]
     gpu_count = instance.get("gpu_count", 1)
-    now = time.time()
     
-    # Get samples from last 24 hours
-    cutoff_24h = now - (24 * 3600)
-    samples_24h = db.get_gpu_samples_since(conn, instance_id, cutoff_24h)
+    # Group samples by timestamp (averaging across GPUs)
+    grouped_24h = utils_idle.group_samples_by_timestamp(samples_24h)
     
-    # Get samples from idle window
+    # Ascending time points; the idle window is a suffix, so count it instead of querying again
+    timestamps = [g["timestamp"] for g in grouped_24h]
     cutoff_idle = now - (IDLE_SHUTDOWN_HOURS * 3600)
-    samples_idle_window = db.get_gpu_samples_since(conn, instance_id, cutoff_idle)
-    
-    # Group samples by timestamp (averaging across GPUs)
-    grouped_24h = group_samples_by_timestamp(samples_24h)
-    grouped_idle = group_samples_by_timestamp(samples_idle_window)
+    samples_idle_window = len(timestamps) - bisect.bisect_right(timestamps, cutoff_idle)
     
     # Calculate runtime
     first_seen = instance.get("first_seen")
@@ -120,14 +86,13 @@ def get_instance_stats(conn, instance: dict) -> dict:
     time_until_min_runtime = max(0, MIN_RUNTIME_HOURS - runtime_hours)
     runtime_met = runtime_hours >= MIN_RUNTIME_HOURS
     
-    # Get latest storage info
-    storage = db.get_latest_storage(conn, instance_id)
+    # Latest storage info
     root_storage = next((s for s in storage if s["mount_point"] == "/"), None)
     home_storage = next((s for s in storage if s["mount_point"] == "/home"), None)
     
     stats = {
         "samples_24h": len(grouped_24h),  # Count of time points, not individual GPU samples
-        "samples_idle_window": len(grouped_idle),
+        "samples_idle_window": samples_idle_window,
         "gpu_count": gpu_count,
         "current_gpu": None,
         "avg_gpu_1h": None,
@@ -141,41 +106,43 @@ def get_instance_stats(conn, instance: dict) -> dict:
         "is_active": False,
         "storage_root": root_storage,
         "storage_home": home_storage,
+        "whitelisted": utils_idle.is_whitelisted(instance),
     }
     
     if not grouped_24h:
         return stats
     
-    # Sort by timestamp (most recent first)
-    grouped_24h.sort(key=lambda s: s["timestamp"], reverse=True)
-    
-    # Current GPU (average of all GPUs at most recent timestamp)
-    stats["current_gpu"] = grouped_24h[0]["avg_utilization"]
+    # Current GPU (average of all GPUs at most recent timestamp; groups are already ascending)
+    stats["current_gpu"] = grouped_24h[-1]["avg_utilization"]
     stats["is_active"] = stats["current_gpu"] > 0
     
-    # Average GPU last hour
+    # Average GPU last hour (walk back from the newest point, stopping at the cutoff)
     cutoff_1h = now - 3600
-    samples_1h = [s for s in grouped_24h if s["timestamp"] > cutoff_1h]
+    samples_1h = list(itertools.takewhile(lambda s: s["timestamp"] > cutoff_1h, reversed(grouped_24h)))
     if samples_1h:
         stats["avg_gpu_1h"] = sum(s["avg_utilization"] for s in samples_1h) / len(samples_1h)
     
-    # Calculate idle duration (continuous ALL GPUs at 0% from now backwards)
-    idle_start = None
-    for sample in grouped_24h:
-        if sample["all_zero"]:
-            idle_start = sample["timestamp"]
-        else:
-            break
+    # Whitelisted instances are never terminated, so idle tracking doesn't apply
+    if stats["whitelisted"]:
+        return stats
+    
+    # Calculate idle duration (continuous ALL GPUs at 0% from now backwards): the idle run
+    # starts at the first time point after the one holding the last non-zero sample
+    if last_active is None:
+        idle_start = timestamps[0]
+    else:
+        i = bisect.bisect_right(timestamps, last_active)
+        idle_start = timestamps[i] if i < len(timestamps) else None
     
     if idle_start is not None:
         stats["idle_duration_hours"] = (now - idle_start) / 3600
         stats["time_until_idle_threshold"] = max(0, IDLE_SHUTDOWN_HOURS - stats["idle_duration_hours"])
         
-        # Check if idle condition is met (all time points in window have all GPUs at 0%)
-        min_samples = int(IDLE_SHUTDOWN_HOURS * 60 * 0.8)
-        if len(grouped_idle) >= min_samples:
-            all_idle = all(s["all_zero"] for s in grouped_idle)
-            stats["idle_met"] = all_idle
+        # Check if idle condition is met (no non-zero sample inside the window). Compare the
+        # sample itself, not its time point: a point can start before the cutoff and still
+        # hold a later non-zero sample, which terminate_idle_instances counts as activity
+        if samples_idle_window >= utils_idle.MIN_IDLE_SAMPLES:
+            stats["idle_met"] = last_active is None or last_active <= cutoff_idle
         
         # Will terminate only if BOTH conditions are met
         stats["will_terminate"] = stats["runtime_met"] and stats["idle_met"]
@@ -183,25 +150,9 @@ def get_instance_stats(conn, instance: dict) -> dict:
     return stats
 
 
-def get_cost_for_key(conn, ssh_key: str) -> int:
-    """Get total cost in cents for an SSH key."""
-    costs = db.get_all_costs(conn)
-    for c in costs:
-        if c["ssh_key"] == ssh_key:
-            return c["total_cents"]
-    return 0
-
-
-def is_whitelisted(instance: dict) -> bool:
-    """Check if instance is whitelisted (has 'whitelist' in custom name, case-insensitive)."""
-    # Check the user-set custom name (not the auto-generated hostname)
-    custom_name = instance.get("name") or ""
-    return "whitelist" in custom_name.lower()
-
-
 def get_status_indicator(stats: dict, instance: dict) -> str:
     """Get status emoji and text."""
-    if is_whitelisted(instance):
+    if stats["whitelisted"]:
         return "🔒 WHITELIST"
     elif stats["will_terminate"]:
         return "🔴 TERMINATE"
@@ -226,9 +177,7 @@ def print_instance_status(instance: dict, stats: dict, cost_cents: int, budget_i
     itype = instance.get("instance_type", "?")
     
     # SSH key
-    ssh_keys = instance.get("ssh_key_names", [])
-    if isinstance(ssh_keys, str):
-        ssh_keys = json.loads(ssh_keys)
+    ssh_keys = instance["ssh_key_names"]
     ssh_key = ssh_keys[0] if ssh_keys else "-"
     
     # Times
@@ -255,8 +204,7 @@ def print_instance_status(instance: dict, stats: dict, cost_cents: int, budget_i
         idle_check = "(not idle)"
     
     # Termination status
-    whitelisted = is_whitelisted(instance)
-    if whitelisted:
+    if stats["whitelisted"]:
         term_str = "🔒 never"
     elif stats["will_terminate"]:
         term_str = "🔴 NOW!"
@@ -283,56 +231,91 @@ def print_instance_status(instance: dict, stats: dict, cost_cents: int, budget_i
         else:
             budget_str = f"{format_cost(remaining)} left of {format_cost(limit)}"
     
-    W = 72  # inner width
+    W = BOX_WIDTH
     # Use custom name as title if set, otherwise hostname
     title = custom_name if custom_name else hostname
-    print(f"┌─ {title} {'─' * (W - len(title) - 2)}┐")
+    rows = []
     
     # Show hostname on first line if we used custom name as title
     if custom_name:
-        line0 = f"  {status:<12}  Host: {hostname}"
-        print(f"│{line0:<{W}}│")
-        line1 = f"  IP: {ip:<15}  Type: {itype}"
+        rows.append(f"  {status:<12}  Host: {hostname}")
+        rows.append(f"  IP: {ip:<15}  Type: {itype}")
     else:
-        line1 = f"  {status:<12}  IP: {ip:<15}  Type: {itype}"
-    print(f"│{line1:<{W}}│")
+        rows.append(f"  {status:<12}  IP: {ip:<15}  Type: {itype}")
     # Account info
     account_name = instance.get("account") or "default"
-    line2 = f"  Account: {account_name:<12}  Key: {ssh_key:<14}  Cost: {cost}"
-    print(f"│{line2:<{W}}│")
+    rows.append(f"  Account: {account_name:<12}  Key: {ssh_key:<14}  Cost: {cost}")
     if budget_str:
-        line2b = f"  Budget: {budget_str}"
-        print(f"│{line2b:<{W}}│")
-    line3 = f"  {gpu_label}: {gpu_now:<4} now, {gpu_1h:<4} 1h avg"
-    print(f"│{line3:<{W}}│")
+        rows.append(f"  Budget: {budget_str}")
+    rows.append(f"  {gpu_label}: {gpu_now:<4} now, {gpu_1h:<4} 1h avg")
     
     # Storage info
     root_storage = stats.get("storage_root")
     if root_storage:
-        disk_str = f"  Disk: {root_storage['use_percent']}% used ({root_storage['used_gb']:.0f}G/{root_storage['total_gb']:.0f}G)"
-        print(f"│{disk_str:<{W}}│")
+        rows.append(f"  Disk: {root_storage['use_percent']}% used ({root_storage['used_gb']:.0f}G/{root_storage['total_gb']:.0f}G)")
+    
+    rows.append(f"  Runtime: {runtime_str:<6} (min {MIN_RUNTIME_HOURS}h) {runtime_check}")
+    rows.append(f"  Idle:    {idle_str:<6} (max {IDLE_SHUTDOWN_HOURS}h) {idle_check}")
+    rows.append(f"  First: {first_seen}   Last: {last_seen}")
     
-    line4 = f"  Runtime: {runtime_str:<6} (min {MIN_RUNTIME_HOURS}h) {runtime_check}"
-    print(f"│{line4:<{W}}│")
-    line5 = f"  Idle:    {idle_str:<6} (max {IDLE_SHUTDOWN_HOURS}h) {idle_check}"
-    print(f"│{line5:<{W}}│")
-    line6 = f"  First: {first_seen}   Last: {last_seen}"
-    print(f"│{line6:<{W}}│")
-    print(f"└{'─' * W}┘")
+    # Whole box in one write
+    lines = [f"┌─ {title} {'─' * (W - len(title) - 2)}┐"]
+    lines.extend(f"│{row:<{W}}│" for row in rows)
+    lines.append(BOX_BOTTOM)
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+def instance_to_json(r: dict) -> dict:
+    """Flatten one result row (instance, stats, cost, budget) into its JSON output record."""
+    inst = r["instance"]
+    stats = r["stats"]
+    ssh_keys = inst["ssh_key_names"]
+    budget_info = r.get("budget_info")
+    root_storage = stats.get("storage_root")
+    return {
+        "id": inst["id"],
+        "account": inst.get("account") or "default",
+        "hostname": inst.get("hostname"),
+        "custom_name": inst.get("name"),
+        "ip": inst.get("ip"),
+        "instance_type": inst.get("instance_type"),
+        "ssh_key": ssh_keys[0] if ssh_keys else None,
+        "whitelisted": stats["whitelisted"],
+        "first_seen": inst.get("first_seen"),
+        "last_seen": inst.get("last_seen"),
+        "cost_cents": r["cost_cents"],
+        "budget_limit_cents": budget_info["limit"] if budget_info else None,
+        "budget_spent_cents": budget_info["spent"] if budget_info else None,
+        "current_gpu_pct": stats["current_gpu"],
+        "avg_gpu_1h_pct": stats["avg_gpu_1h"],
+        "storage_used_gb": root_storage["used_gb"] if root_storage else None,
+        "storage_total_gb": root_storage["total_gb"] if root_storage else None,
+        "storage_use_pct": root_storage["use_percent"] if root_storage else None,
+        "runtime_hours": stats["runtime_hours"],
+        "runtime_met": stats["runtime_met"],
+        "idle_hours": stats["idle_duration_hours"],
+        "idle_met": stats["idle_met"],
+        "will_terminate": stats["will_terminate"],
+    }
 
 
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="Check Lambda instance status")
     parser.add_argument("--json", action="store_true", help="Output as JSON")
+    parser.add_argument("--pretty", action="store_true", help="Indent JSON output (default: compact)")
+    parser.add_argument("--ndjson", action="store_true", help="Output one JSON object per instance per line")
     args = parser.parse_args()
     
     conn = db.get_db()
+    db.begin_read(conn)
     
     try:
         active = db.get_active_instances(conn)
         
         if not active:
+            if args.ndjson:
+                return
             if args.json:
                 print(json.dumps({"instances": [], "message": "No active instances"}))
             else:
@@ -344,15 +327,35 @@ def main():
         accounts_list = utils_accounts.get_account_list(accounts_data)
         account_budgets = {acc["name"]: acc for acc in accounts_list}
         account_costs = {c["account"]: c["total_cents"] for c in db.get_all_account_costs(conn)}
+        cost_by_key = {c["ssh_key"]: c["total_cents"] for c in db.get_all_costs(conn)}
+        
+        # GPU samples and latest storage for all instances in one query each, split per instance
+        now = time.time()
+        instance_ids = [inst["id"] for inst in active]
+        cutoff_24h = now - (24 * 3600)
+        samples = db.get_gpu_samples_bulk(conn, instance_ids, cutoff_24h)
+        samples_by_instance = {
+            instance_id: list(rows)
+            for instance_id, rows in itertools.groupby(samples, key=operator.itemgetter("instance_id"))
+        }
+        # Only needed for idle tracking, which whitelisted instances skip
+        last_active_by_instance = db.get_last_active_bulk(
+            conn, [inst["id"] for inst in active if not utils_idle.is_whitelisted(inst)], cutoff_24h
+        )
+        storage_by_instance = db.get_latest_storage_bulk(conn, instance_ids, now - 3600)  # Last hour
         
         # Build results with stats
         results = []
         for inst in active:
-            stats = get_instance_stats(conn, inst)
-            ssh_keys = inst.get("ssh_key_names", [])
-            if isinstance(ssh_keys, str):
-                ssh_keys = json.loads(ssh_keys)
-            cost = get_cost_for_key(conn, ssh_keys[0]) if ssh_keys else 0
+            stats = get_instance_stats(
+                inst,
+                samples_by_instance.get(inst["id"], []),
+                last_active_by_instance.get(inst["id"]),
+                storage_by_instance.get(inst["id"], []),
+                now,
+            )
+            ssh_keys = inst["ssh_key_names"]
+            cost = cost_by_key.get(ssh_keys[0], 0) if ssh_keys else 0
             
             # Get budget info for this instance's account
             account_name = inst.get("account") or "default"
@@ -367,50 +370,24 @@ def main():
                 "stats": stats,
                 "cost_cents": cost,
                 "budget_info": budget_info,
+                # Active first (is_active=True), then by GPU usage descending
+                "sort_key": (not stats["is_active"], -(stats["current_gpu"] or 0)),
             })
         
-        # Sort: active first (is_active=True), then by GPU usage descending
-        results.sort(key=lambda r: (not r["stats"]["is_active"], -(r["stats"]["current_gpu"] or 0)))
+        results.sort(key=operator.itemgetter("sort_key"))
         
-        if args.json:
-            output = []
+        if args.ndjson:
+            # One compact record per line, written as soon as it is built
             for r in results:
-                inst = r["instance"]
-                stats = r["stats"]
-                ssh_keys = inst.get("ssh_key_names", [])
-                if isinstance(ssh_keys, str):
-                    ssh_keys = json.loads(ssh_keys)
-                budget_info = r.get("budget_info")
-                root_storage = stats.get("storage_root")
-                output.append({
-                    "id": inst["id"],
-                    "account": inst.get("account") or "default",
-                    "hostname": inst.get("hostname"),
-                    "custom_name": inst.get("name"),
-                    "ip": inst.get("ip"),
-                    "instance_type": inst.get("instance_type"),
-                    "ssh_key": ssh_keys[0] if ssh_keys else None,
-                    "whitelisted": is_whitelisted(inst),
-                    "first_seen": inst.get("first_seen"),
-                    "last_seen": inst.get("last_seen"),
-                    "cost_cents": r["cost_cents"],
-                    "budget_limit_cents": budget_info["limit"] if budget_info else None,
-                    "budget_spent_cents": budget_info["spent"] if budget_info else None,
-                    "current_gpu_pct": stats["current_gpu"],
-                    "avg_gpu_1h_pct": stats["avg_gpu_1h"],
-                    "storage_used_gb": root_storage["used_gb"] if root_storage else None,
-                    "storage_total_gb": root_storage["total_gb"] if root_storage else None,
-                    "storage_use_pct": root_storage["use_percent"] if root_storage else None,
-                    "runtime_hours": stats["runtime_hours"],
-                    "runtime_met": stats["runtime_met"],
-                    "idle_hours": stats["idle_duration_hours"],
-                    "idle_met": stats["idle_met"],
-                    "will_terminate": stats["will_terminate"],
-                })
-            print(json.dumps(output, indent=2))
+                sys.stdout.write(json.dumps(instance_to_json(r), separators=(",", ":")) + "\n")
+        elif args.json:
+            output = [instance_to_json(r) for r in results]
+            if args.pretty:
+                print(json.dumps(output, indent=2))
+            else:
+                sys.stdout.write(json.dumps(output, separators=(",", ":")) + "\n")
         else:
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print(f"\n  Lambda Instance Status  │  {now}")
+            print(f"\n  Lambda Instance Status  │  {datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')}")
             print(f"  Termination: ≥{MIN_RUNTIME_HOURS}h runtime AND ≥{IDLE_SHUTDOWN_HOURS}h idle")
             print(f"  {len(active)} active instance(s)\n")
             
@@ -419,6 +396,7 @@ def main():
                 print()
             
     finally:
+        conn.commit()
         conn.close()
 
 
@@ -4,36 +4,21 @@ Check usage/cost per Lambda account over different time periods.
 Supports multiple Lambda Labs accounts.
 """
 
+import functools
 import json
+import sys
 import time
-from collections import defaultdict
 from datetime import datetime, timedelta
-from pathlib import Path
 
 import utils_accounts
+import utils_config
 import utils_db as db
 
-PROJECT_DIR = Path(__file__).parent.parent
-
-
-def load_config():
-    """Load config.env for defaults."""
-    config_path = PROJECT_DIR / "config.env"
-    config = {}
-    if config_path.exists():
-        with open(config_path) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    config[key.strip()] = value.strip()
-    return config
-
-
-CONFIG = load_config()
+CONFIG = utils_config.CONFIG
 DEFAULT_LIMIT = int(CONFIG.get("BUDGET_LIMIT_DEFAULT", "500000"))
 
 
+@functools.lru_cache(maxsize=4096)
 def format_cost(cents: float) -> str:
     """Format cents to dollar string."""
     return f"${cents / 100:.2f}"
@@ -50,71 +35,87 @@ def format_duration(hours: float) -> str:
         return f"{days:.1f}d"
 
 
-def get_usage_by_account(conn, since_timestamp: float) -> dict:
+def get_usage_by_windows(conn, periods: dict[str, float]) -> dict[str, dict]:
     """
-    Calculate usage per account since a given timestamp.
-    Returns dict of {account: {cost_cents, hours, instances}}.
+    Calculate usage per account for several windows at once, given {name: since_timestamp}.
+    Returns {name: {account: {cost_cents, hours, instances}}}.
     """
-    # Get all GPU samples in the time range, grouped by instance
-    samples = conn.execute("""
-        SELECT DISTINCT instance_id, timestamp 
-        FROM gpu_samples 
-        WHERE timestamp > ?
-        ORDER BY instance_id, timestamp
-    """, (since_timestamp,)).fetchall()
+    bucket = db.USAGE_BUCKET_SECONDS
     
-    if not samples:
-        return {}
+    # Sampled time slots per instance (each slot = ~1 minute): whole hours from usage_rollup,
+    # raw samples only for the partial hour holding each window's start
+    boundaries = {name: db.usage_bucket_start(since) + bucket for name, since in periods.items()}
+    earliest = min(boundaries.values())
+    minutes_by_window = {name: {} for name in periods}
     
-    # Get instance info (hourly cost, account) - includes terminated instances
-    instances = {}
-    for row in conn.execute("SELECT * FROM instances").fetchall():
-        inst = dict(row)
-        instances[inst["id"]] = {
-            "hourly_cents": inst.get("hourly_cost_cents", 0),
-            "account": inst.get("account") or "default",
-            "name": inst.get("hostname") or inst.get("name") or inst["id"][:8],
-            "type": inst.get("instance_type", "unknown"),
-            "status": inst.get("status", "unknown"),
-        }
+    # One pass over the rollup for the widest window, summed per instance and window in SQL so
+    # Python only sees one row per instance rather than one per instance-hour
+    window_sums = ", ".join("SUM(CASE WHEN bucket_start >= ? THEN minutes ELSE 0 END)" for _ in boundaries)
+    for instance_id, *window_minutes in conn.execute(
+        f"SELECT instance_id, {window_sums} FROM usage_rollup WHERE bucket_start >= ? GROUP BY instance_id",
+        (*boundaries.values(), earliest),
+    ):
+        for name, minutes in zip(boundaries, window_minutes):
+            if minutes:
+                minutes_by_window[name][instance_id] = minutes
     
-    # Group samples by instance and count time slots (each sample = ~1 minute)
-    instance_minutes = defaultdict(int)
-    for sample in samples:
-        instance_minutes[sample["instance_id"]] += 1
+    for name, since in periods.items():
+        counts = minutes_by_window[name]
+        for instance_id, minutes in conn.execute("""
+            SELECT instance_id, COUNT(DISTINCT timestamp) FROM gpu_samples
+            WHERE timestamp > ? AND CAST(timestamp / ? AS INTEGER) * ? < ?
+            GROUP BY instance_id
+        """, (since, bucket, bucket, boundaries[name])):
+            counts[instance_id] = counts.get(instance_id, 0) + minutes
+    
+    # Hourly cost and account of every instance sampled in any window, fetched once - includes terminated instances
+    # Unpacked once into (hourly_cost_cents, account, name, status) rather than per window
+    instances = {}
+    for instance_id, hourly_cost_cents, account, hostname, name, status in conn.execute("""
+        SELECT id, hourly_cost_cents, account, hostname, name, status FROM instances
+        WHERE id IN (SELECT instance_id FROM usage_rollup WHERE bucket_start >= ?)
+    """, (earliest - bucket,)):
+        instances[instance_id] = (hourly_cost_cents, account or "default", hostname or name or instance_id[:8], status)
     
-    # Calculate cost per account
-    usage_by_account = defaultdict(lambda: {"cost_cents": 0, "hours": 0, "instances": {}})
+    return {name: _usage_by_account(counts, instances) for name, counts in minutes_by_window.items()}
+
+
+def _usage_by_account(minutes_by_instance: dict[str, int], instances: dict[str, tuple]) -> dict:
+    """Turn one window's {instance_id: minutes} into {account: {cost_cents, hours, instances}}."""
+    # [cost_cents, hours, instances] per account while accumulating; shaped into dicts at the end
+    totals = {}
     
-    for instance_id, minutes in instance_minutes.items():
-        if instance_id not in instances:
+    for instance_id in sorted(minutes_by_instance):
+        info = instances.get(instance_id)
+        if info is None:
             continue
         
-        inst = instances[instance_id]
-        account = inst["account"]
+        hourly_cost_cents, account, name, status = info
+        minutes = minutes_by_instance[instance_id]
         hours = minutes / 60
-        cost_cents = (inst["hourly_cents"] * minutes) / 60
         
-        usage_by_account[account]["cost_cents"] += cost_cents
-        usage_by_account[account]["hours"] += hours
-        usage_by_account[account]["instances"][inst["name"]] = {
-            "hours": hours,
-            "status": inst["status"],
-        }
-    
-    for acct in usage_by_account:
-        usage_by_account[acct]["instances"] = dict(usage_by_account[acct]["instances"])
+        acc = totals.get(account)
+        if acc is None:
+            acc = totals[account] = [0, 0, {}]
+        acc[0] += (hourly_cost_cents * minutes) / 60
+        acc[1] += hours
+        acc[2][name] = {"hours": hours, "status": status}
     
-    return dict(usage_by_account)
+    return {
+        account: {"cost_cents": cost_cents, "hours": hours, "instances": instances_by_name}
+        for account, (cost_cents, hours, instances_by_name) in totals.items()
+    }
 
 
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="Check usage per Lambda account")
     parser.add_argument("--json", action="store_true", help="Output as JSON")
+    parser.add_argument("--pretty", action="store_true", help="Indent JSON output (default: compact)")
     args = parser.parse_args()
     
     conn = db.get_db()
+    db.begin_read(conn)
     
     try:
         now = time.time()
@@ -125,14 +126,11 @@ def main():
         account_budgets = {acc["name"]: acc for acc in accounts_list}
         default_limit = accounts_data.get("defaults", {}).get("limit_cents", DEFAULT_LIMIT)
         
-        # Calculate usage for different time periods
+        # Calculate usage for different time periods in one pass
         periods = {
             "24h": now - 86400,
         }
-        
-        usage_data = {}
-        for period_name, since in periods.items():
-            usage_data[period_name] = get_usage_by_account(conn, since)
+        usage_data = get_usage_by_windows(conn, periods)
         
         # Get all-time totals from account_costs table
         all_time = {c["account"]: {"cost_cents": c["total_cents"]} for c in db.get_all_account_costs(conn)}
@@ -140,11 +138,16 @@ def main():
         # Get all accounts (from config + from costs)
         all_accounts = set(account_budgets.keys()) | set(all_time.keys())
         
+        # Budget limit per account, resolved once (accounts missing from the config use the default)
+        limits = {
+            acct: account_budgets[acct]["limit_cents"] if acct in account_budgets else default_limit
+            for acct in all_accounts
+        }
+        
         if args.json:
             output = {}
             for acct in sorted(all_accounts):
-                acc_config = account_budgets.get(acct)
-                limit = acc_config["limit_cents"] if acc_config else default_limit
+                limit = limits[acct]
                 total = all_time.get(acct, {}).get("cost_cents", 0)
                 output[acct] = {
                     "24h": usage_data["24h"].get(acct, {}).get("cost_cents", 0),
@@ -152,30 +155,36 @@ def main():
                     "limit": limit,
                     "remaining": limit - total,
                 }
-            print(json.dumps(output, indent=2))
+            if args.pretty:
+                print(json.dumps(output, indent=2))
+            else:
+                sys.stdout.write(json.dumps(output, separators=(",", ":")) + "\n")
         else:
-            print(f"\n  Usage by Account  │  {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            print(f"  Default budget: {format_cost(default_limit)}\n")
+            # Build the whole report and write it once
+            lines = []
+            lines.append(f"\n  Usage by Account  │  {datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')}")
+            lines.append(f"  Default budget: {format_cost(default_limit)}\n")
             
             if not all_accounts:
-                print("  No usage data found.\n")
+                lines.append("  No usage data found.\n")
+                sys.stdout.write("\n".join(lines) + "\n")
                 return
             
             # Header
-            print(f"  {'Account':<20} │ {'24 Hours':>9} │ {'Total':>10} │ {'Limit':>10} │ {'Remaining':>10}")
-            print(f"  {'-'*20}-┼-{'-'*9}-┼-{'-'*10}-┼-{'-'*10}-┼-{'-'*10}")
+            lines.append(f"  {'Account':<20} │ {'24 Hours':>9} │ {'Total':>10} │ {'Limit':>10} │ {'Remaining':>10}")
+            lines.append(f"  {'-'*20}-┼-{'-'*9}-┼-{'-'*10}-┼-{'-'*10}-┼-{'-'*10}")
             
             # Sort by total cost descending
-            sorted_accounts = sorted(all_accounts, key=lambda a: all_time.get(a, {}).get("cost_cents", 0), reverse=True)
+            cost_totals = {acct: all_time.get(acct, {}).get("cost_cents", 0) for acct in all_accounts}
+            sorted_accounts = sorted(all_accounts, key=cost_totals.__getitem__, reverse=True)
             
             totals = {"24h": 0, "total": 0}
             
             for acct in sorted_accounts:
                 cost_24h = usage_data["24h"].get(acct, {}).get("cost_cents", 0)
-                cost_total = all_time.get(acct, {}).get("cost_cents", 0)
+                cost_total = cost_totals[acct]
                 
-                acc_config = account_budgets.get(acct)
-                limit = acc_config["limit_cents"] if acc_config else default_limit
+                limit = limits[acct]
                 remaining = limit - cost_total
                 
                 totals["24h"] += cost_24h
@@ -185,7 +194,7 @@ def main():
                 display_name = acct[:20] if len(acct) <= 20 else acct[:17] + "..."
                 
                 # Show limit with indicator if using default
-                is_custom_limit = acc_config is not None
+                is_custom_limit = acct in account_budgets
                 limit_str = format_cost(limit) if is_custom_limit else f"{format_cost(limit)}*"
                 
                 # Remaining with status
@@ -196,30 +205,33 @@ def main():
                 else:
                     remaining_str = format_cost(remaining)
                 
-                print(f"  {display_name:<20} │ {format_cost(cost_24h):>9} │ {format_cost(cost_total):>10} │ {limit_str:>10} │ {remaining_str:>10}")
+                lines.append(f"  {display_name:<20} │ {format_cost(cost_24h):>9} │ {format_cost(cost_total):>10} │ {limit_str:>10} │ {remaining_str:>10}")
             
             # Totals row
-            print(f"  {'-'*20}-┼-{'-'*9}-┼-{'-'*10}-┼-{'-'*10}-┼-{'-'*10}")
-            print(f"  {'TOTAL':<20} │ {format_cost(totals['24h']):>9} │ {format_cost(totals['total']):>10} │ {'-':>10} │ {'-':>10}")
-            print(f"\n  * = using default limit, ! = <20% left, ⚠ = over budget")
+            lines.append(f"  {'-'*20}-┼-{'-'*9}-┼-{'-'*10}-┼-{'-'*10}-┼-{'-'*10}")
+            lines.append(f"  {'TOTAL':<20} │ {format_cost(totals['24h']):>9} │ {format_cost(totals['total']):>10} │ {'-':>10} │ {'-':>10}")
+            lines.append(f"\n  * = using default limit, ! = <20% left, ⚠ = over budget")
             
-            print()
+            lines.append("")
             
             # Show hours breakdown for recent period
             if usage_data["24h"]:
-                print("  Hours by instance (24h):")
+                lines.append("  Hours by instance (24h):")
                 for acct in sorted_accounts:
                     data = usage_data["24h"].get(acct, {})
                     instances = data.get("instances", {})
                     if instances:
-                        print(f"    {acct}:")
+                        lines.append(f"    {acct}:")
                         for inst_name, inst_data in sorted(instances.items(), key=lambda x: x[1]["hours"], reverse=True):
                             status = inst_data.get("status", "unknown")
                             status_icon = "●" if status == "active" else "○"
-                            print(f"      {status_icon} {inst_name}: {format_duration(inst_data['hours'])}")
-                print()
+                            lines.append(f"      {status_icon} {inst_name}: {format_duration(inst_data['hours'])}")
+                lines.append("")
+            
+            sys.stdout.write("\n".join(lines) + "\n")
         
     finally:
+        conn.commit()
         conn.close()
 
 
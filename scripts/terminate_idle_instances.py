@@ -5,35 +5,19 @@ Supports multiple Lambda Labs accounts.
 Run via cron separately from monitor.py for independent control.
 """
 
+import itertools
 import json
+import operator
 import time
 from datetime import datetime
-from pathlib import Path
 
 import utils_accounts
 import utils_db as db
+import utils_idle
 import utils_lambda_api as lambda_api
 
-PROJECT_DIR = Path(__file__).parent.parent
-
-
-# Load config
-def load_config():
-    config_path = PROJECT_DIR / "config.env"
-    config = {}
-    if config_path.exists():
-        with open(config_path) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    config[key.strip()] = value.strip()
-    return config
-
-
-CONFIG = load_config()
-MIN_RUNTIME_HOURS = float(CONFIG.get("MIN_RUNTIME_HOURS", "4"))
-IDLE_SHUTDOWN_HOURS = float(CONFIG.get("IDLE_SHUTDOWN_HOURS", "2"))
+MIN_RUNTIME_HOURS = utils_idle.MIN_RUNTIME_HOURS
+IDLE_SHUTDOWN_HOURS = utils_idle.IDLE_SHUTDOWN_HOURS
 
 
 def log(msg: str):
@@ -42,49 +26,7 @@ def log(msg: str):
     print(f"[{ts}] {msg}")
 
 
-def group_samples_by_timestamp(samples: list[dict], tolerance: float = 30.0) -> list[dict]:
-    """
-    Group samples by timestamp (within tolerance seconds) and check if all GPUs are idle.
-    Returns list of {timestamp, all_zero, gpu_count}.
-    """
-    if not samples:
-        return []
-    
-    sorted_samples = sorted(samples, key=lambda s: s["timestamp"])
-    grouped = []
-    current_group = [sorted_samples[0]]
-    
-    for sample in sorted_samples[1:]:
-        if sample["timestamp"] - current_group[0]["timestamp"] <= tolerance:
-            current_group.append(sample)
-        else:
-            utils = [s["utilization"] for s in current_group]
-            grouped.append({
-                "timestamp": current_group[0]["timestamp"],
-                "all_zero": all(u == 0 for u in utils),
-                "gpu_count": len(current_group),
-            })
-            current_group = [sample]
-    
-    if current_group:
-        utils = [s["utilization"] for s in current_group]
-        grouped.append({
-            "timestamp": current_group[0]["timestamp"],
-            "all_zero": all(u == 0 for u in utils),
-            "gpu_count": len(current_group),
-        })
-    
-    return grouped
-
-
-def is_whitelisted(instance: dict) -> bool:
-    """Check if instance is whitelisted (has 'whitelist' in custom name, case-insensitive)."""
-    # Check the user-set custom name (not the auto-generated hostname)
-    custom_name = instance.get("name") or ""
-    return "whitelist" in custom_name.lower()
-
-
-def check_and_terminate_idle(conn, instance: dict, api_key: str, dry_run: bool = False) -> bool:
+def should_terminate_idle(instance: dict, last_activity: float | None, samples: list[dict], now: float) -> bool:
     """
     Check if instance should be terminated. Both conditions must be met:
     1. Running for at least MIN_RUNTIME_HOURS
@@ -92,13 +34,17 @@ def check_and_terminate_idle(conn, instance: dict, api_key: str, dry_run: bool =
     
     Instances with 'whitelist' in their name are never terminated.
     
-    Returns True if instance was (or would be) terminated.
+    last_activity is the timestamp of the instance's latest non-zero GPU sample in the idle
+    window (None if there is none) and samples its GPU samples in that window; the caller
+    only needs to load samples when last_activity is None. All cutoffs are relative to now,
+    which the caller samples once per run.
+    
+    Only logs the decision; termination is left to the caller.
     """
     name = instance.get("hostname") or instance.get("name") or instance["id"][:8]
-    now = time.time()
     
     # Check whitelist
-    if is_whitelisted(instance):
+    if utils_idle.is_whitelisted(instance):
         log(f"    {name}: Whitelisted - skipping")
         return False
     
@@ -114,52 +60,51 @@ def check_and_terminate_idle(conn, instance: dict, api_key: str, dry_run: bool =
         log(f"    {name}: Running {runtime_hours:.1f}h (need {MIN_RUNTIME_HOURS}h min, {remaining:.1f}h to go)")
         return False
     
-    # Condition 2: Check idle time
-    cutoff = now - (IDLE_SHUTDOWN_HOURS * 3600)
-    samples = db.get_gpu_samples_since(conn, instance["id"], cutoff)
+    # Condition 2: Check idle time - any non-zero sample in the window settles it
+    if last_activity is not None:
+        idle_hours = (now - last_activity) / 3600
+        remaining = IDLE_SHUTDOWN_HOURS - idle_hours
+        log(f"    {name}: Running {runtime_hours:.1f}h, idle {idle_hours:.1f}h (need {IDLE_SHUTDOWN_HOURS}h idle, {remaining:.1f}h to go)")
+        return False
     
-    # Group samples by timestamp (handles multi-GPU)
-    grouped = group_samples_by_timestamp(samples)
+    # All samples are 0% - group them by timestamp (handles multi-GPU) to check coverage
+    grouped = utils_idle.group_samples_by_timestamp(samples)
     
     # Need at least some time points to make a decision (80% coverage)
-    min_samples = int(IDLE_SHUTDOWN_HOURS * 60 * 0.8)
-    if len(grouped) < min_samples:
-        log(f"    {name}: Not enough samples ({len(grouped)}/{min_samples}) - skipping")
+    if len(grouped) < utils_idle.MIN_IDLE_SAMPLES:
+        log(f"    {name}: Not enough samples ({len(grouped)}/{utils_idle.MIN_IDLE_SAMPLES}) - skipping")
         return False
     
-    # Check if all time points have all GPUs at 0%
-    all_idle = all(s["all_zero"] for s in grouped)
-    
-    if not all_idle:
-        # Find first non-zero sample to calculate how long truly idle
-        non_zero_times = [s["timestamp"] for s in grouped if not s["all_zero"]]
-        if non_zero_times:
-            last_activity = max(non_zero_times)
-            idle_hours = (now - last_activity) / 3600
-            remaining = IDLE_SHUTDOWN_HOURS - idle_hours
-            log(f"    {name}: Running {runtime_hours:.1f}h, idle {idle_hours:.1f}h (need {IDLE_SHUTDOWN_HOURS}h idle, {remaining:.1f}h to go)")
-        return False
-    
-    # Both conditions met - terminate
-    if dry_run:
-        log(f"    {name}: WOULD TERMINATE (running {runtime_hours:.1f}h, idle {IDLE_SHUTDOWN_HOURS}+ hours)")
-        return True
-    
-    log(f"    {name}: Terminating (running {runtime_hours:.1f}h, idle {IDLE_SHUTDOWN_HOURS}+ hours)...")
-    try:
-        terminated = lambda_api.terminate_instance(api_key, [instance["id"]])
-        if terminated:
-            log(f"    {name}: Successfully terminated")
-            return True
-        else:
-            log(f"    {name}: Failed to terminate")
-    except Exception as e:
-        log(f"    {name}: Error terminating: {e}")
-    
-    return False
+    # Both conditions met
+    log(f"    {name}: Idle (running {runtime_hours:.1f}h, idle {IDLE_SHUTDOWN_HOURS}+ hours)")
+    return True
 
 
-def process_account(conn, account: dict, dry_run: bool = False) -> int:
+def check_instances(conn, instances: list[dict], now: float) -> list[dict]:
+    """Return the instances that should be terminated."""
+    cutoff = now - (IDLE_SHUTDOWN_HOURS * 3600)
+    
+    # Latest activity for all instances in one query; most are busy, so only the
+    # rest need their samples, again fetched in one query and split per instance
+    instance_ids = [inst["id"] for inst in instances if not utils_idle.is_whitelisted(inst)]
+    last_active_by_instance = db.get_last_active_bulk(conn, instance_ids, cutoff)
+    idle_ids = [iid for iid in instance_ids if iid not in last_active_by_instance]
+    samples_by_instance = {
+        instance_id: list(rows)
+        for instance_id, rows in itertools.groupby(
+            db.get_gpu_samples_bulk(conn, idle_ids, cutoff), key=operator.itemgetter("instance_id")
+        )
+    }
+    
+    return [
+        inst for inst in instances
+        if should_terminate_idle(
+            inst, last_active_by_instance.get(inst["id"]), samples_by_instance.get(inst["id"], []), now
+        )
+    ]
+
+
+def process_account(conn, account: dict, now: float, dry_run: bool = False) -> int:
     """Process idle instance termination for a single account."""
     account_name = account["name"]
     api_key = account["api_key"]
@@ -175,12 +120,33 @@ def process_account(conn, account: dict, dry_run: bool = False) -> int:
     
     log(f"    {len(active)} active instances")
     
-    terminated_count = 0
-    for inst in active:
-        if check_and_terminate_idle(conn, inst, api_key, dry_run=dry_run):
-            terminated_count += 1
+    to_terminate = check_instances(conn, active, now)
+    
+    if not to_terminate:
+        return 0
+    
+    names = {inst["id"]: inst.get("hostname") or inst.get("name") or inst["id"][:8] for inst in to_terminate}
+    
+    if dry_run:
+        for name in names.values():
+            log(f"    {name}: WOULD TERMINATE")
+        return len(names)
+    
+    # One API call for the whole account rather than one per instance
+    log(f"    Terminating {len(names)} instance(s)...")
+    try:
+        terminated = set(lambda_api.terminate_instance(api_key, list(names)))
+    except Exception as e:
+        log(f"    Error terminating: {e}")
+        return 0
+    
+    for inst_id, name in names.items():
+        if inst_id in terminated:
+            log(f"    {name}: Successfully terminated")
+        else:
+            log(f"    {name}: Failed to terminate")
     
-    return terminated_count
+    return len(terminated & names.keys())
 
 
 def main():
@@ -206,10 +172,11 @@ def main():
     
     try:
         total_terminated = 0
+        now = time.time()
         
         for account in accounts:
             try:
-                terminated = process_account(conn, account, dry_run=args.dry_run)
+                terminated = process_account(conn, account, now, dry_run=args.dry_run)
                 total_terminated += terminated
             except Exception as e:
                 log(f"  Error processing account {account['name']}: {e}")
@@ -6,35 +6,54 @@ Loads account credentials and budget settings from data/accounts.yaml.
 Falls back to config.env LAMBDA_API_KEY for single-account setups.
 """
 
+import copy
+import mmap
 import os
 from pathlib import Path
 
 import yaml
 
+import utils_config
+
 PROJECT_DIR = Path(__file__).parent.parent
 DATA_DIR = PROJECT_DIR / "data"
 ACCOUNTS_FILE = DATA_DIR / "accounts.yaml"
 
+# Above this size, YAML files are mmap'd with read-ahead hints instead of read()
+LARGE_YAML_BYTES = 10_000_000
 
-def _load_config_env():
-    """Load configuration from config.env file."""
-    config_path = PROJECT_DIR / "config.env"
-    config = {}
-    if config_path.exists():
-        with open(config_path) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    config[key.strip()] = value.strip()
-    return config
-
-
-_CONFIG = _load_config_env()
+_CONFIG = utils_config.CONFIG
 DEFAULT_BUDGET_LIMIT = int(_CONFIG.get("BUDGET_LIMIT_DEFAULT", "500000"))
 DEFAULT_MILESTONE_INTERVAL = int(_CONFIG.get("BUDGET_MILESTONE_INTERVAL", "100000"))
 
 
+# {path: ((mtime_ns, size), parsed data)}; a file is re-parsed only when it changes
+_yaml_cache: dict[Path, tuple[tuple[int, int], object]] = {}
+
+
+def _parse_yaml(path: Path, size: int):
+    """Parse a YAML file (libyaml's loader when available). Large files are mmap'd and prefaulted sequentially."""
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    if size <= LARGE_YAML_BYTES or not hasattr(mmap, "MADV_WILLNEED"):
+        with open(path) as f:
+            return yaml.load(f, Loader=loader)
+    
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+        mm.madvise(mmap.MADV_WILLNEED)
+        return yaml.load(mm, Loader=loader)
+
+
+def _read_yaml(path: Path):
+    """Parse a YAML file, reusing the previous parse while it is unchanged. Returns a copy callers may modify."""
+    st = path.stat()
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _yaml_cache.get(path)
+    if cached is None or cached[0] != key:
+        cached = _yaml_cache[path] = (key, _parse_yaml(path, st.st_size))
+    return copy.deepcopy(cached[1])
+
+
 def load_accounts() -> dict:
     """
     Load accounts configuration.
@@ -49,8 +68,7 @@ def load_accounts() -> dict:
     DATA_DIR.mkdir(exist_ok=True)
     
     if ACCOUNTS_FILE.exists():
-        with open(ACCOUNTS_FILE) as f:
-            data = yaml.safe_load(f) or {}
+        data = _read_yaml(ACCOUNTS_FILE) or {}
     else:
         data = {}
     
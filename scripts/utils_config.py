@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Shared loader for config.env (KEY=value lines, '#' comments).
+
+Parsed once on first import; scripts use CONFIG directly.
+"""
+
+import re
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).parent.parent
+CONFIG_PATH = PROJECT_DIR / "config.env"
+
+# KEY=value lines; comment lines (leading '#') never match
+CONFIG_LINE_RE = re.compile(r"^[ \t]*([^#\s=][^=\n]*?)[ \t]*=[ \t]*(.*?)[ \t\r]*$", re.MULTILINE)
+
+
+def load_config() -> dict:
+    """Load config.env into a new dict (empty if the file doesn't exist)."""
+    config = {}
+    if CONFIG_PATH.exists():
+        text = CONFIG_PATH.read_text()
+        for m in CONFIG_LINE_RE.finditer(text):
+            config[m.group(1)] = m.group(2)
+    return config
+
+
+CONFIG = load_config()
@@ -5,22 +5,42 @@ import json
 import os
 import sqlite3
 import time
+from collections.abc import Iterator
 from pathlib import Path
 
 PROJECT_DIR = Path(__file__).parent.parent
 DATA_DIR = PROJECT_DIR / "data"
 DB_PATH = DATA_DIR / "state.db"
 
+# Width of a usage_rollup bucket (sampled minutes per instance per hour)
+USAGE_BUCKET_SECONDS = 3600
+
 
 def get_db() -> sqlite3.Connection:
     """Get database connection, creating schema if needed."""
     DATA_DIR.mkdir(exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    # Wait up to 30s for the write lock (monitor writes from several threads)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
+    # WAL + synchronous=NORMAL: commits no longer fsync, readers don't block the writer
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")  # 256MB
+    conn.execute("PRAGMA cache_size=-65536")  # 64MB page cache (default ~2MB)
     _init_schema(conn)
     return conn
 
 
+def begin_read(conn: sqlite3.Connection):
+    """
+    Put a connection in read-only mode and open one read transaction, so a report's
+    queries share a single WAL snapshot and lock acquisition. End it with conn.commit().
+    """
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute("BEGIN")
+
+
 def _init_schema(conn: sqlite3.Connection):
     """Initialize database schema."""
     conn.executescript("""
@@ -53,6 +73,10 @@ def _init_schema(conn: sqlite3.Connection):
 
         CREATE INDEX IF NOT EXISTS idx_gpu_samples_instance_time 
             ON gpu_samples(instance_id, timestamp);
+        
+        -- Time-only range scans (usage windows, cleanup)
+        CREATE INDEX IF NOT EXISTS idx_gpu_samples_time 
+            ON gpu_samples(timestamp);
 
         CREATE TABLE IF NOT EXISTS storage_samples (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -109,6 +133,25 @@ def _init_schema(conn: sqlite3.Connection):
             last_notified_cents INTEGER DEFAULT 0,
             last_notified_at REAL
         );
+
+        -- Sampled minutes per instance per hour, maintained alongside gpu_samples so
+        -- usage windows don't rescan raw samples (and outlive their 24h retention)
+        CREATE TABLE IF NOT EXISTS usage_rollup (
+            instance_id TEXT NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            minutes INTEGER DEFAULT 0,
+            PRIMARY KEY (instance_id, bucket_start)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_usage_rollup_bucket 
+            ON usage_rollup(bucket_start);
+
+        -- Per-instance SSH probe failures (negative cache for unreachable hosts)
+        CREATE TABLE IF NOT EXISTS gpu_probe_state (
+            instance_id TEXT PRIMARY KEY,
+            last_failure REAL,
+            failure_count INTEGER DEFAULT 0
+        );
     """)
     
     # Migration: add account column to existing instances table if missing
@@ -117,8 +160,30 @@ def _init_schema(conn: sqlite3.Connection):
     except sqlite3.OperationalError:
         conn.execute("ALTER TABLE instances ADD COLUMN account TEXT")
     
+    # Migration: fill usage_rollup from the samples still on disk when it is first created.
+    # Another connection may fill or tick it between the check and the insert, so the
+    # insert re-checks for emptiness itself and skips rows that already exist
+    if conn.execute("SELECT 1 FROM usage_rollup LIMIT 1").fetchone() is None:
+        conn.execute("""
+            INSERT OR IGNORE INTO usage_rollup (instance_id, bucket_start, minutes)
+            SELECT instance_id, CAST(timestamp / ? AS INTEGER) * ? AS bucket_start, COUNT(DISTINCT timestamp)
+            FROM gpu_samples
+            WHERE NOT EXISTS (SELECT 1 FROM usage_rollup)
+            GROUP BY instance_id, bucket_start
+        """, (USAGE_BUCKET_SECONDS, USAGE_BUCKET_SECONDS))
+    
     conn.commit()
-    conn.commit()
+
+
+def usage_bucket_start(timestamp: float) -> int:
+    """Start of the usage_rollup bucket holding timestamp (same rounding as the SQL backfill)."""
+    return int(timestamp / USAGE_BUCKET_SECONDS) * USAGE_BUCKET_SECONDS
+
+
+_ROLLUP_ADD_MINUTE = """
+    INSERT INTO usage_rollup (instance_id, bucket_start, minutes) VALUES (?, ?, 1)
+    ON CONFLICT(instance_id, bucket_start) DO UPDATE SET minutes = minutes + 1
+"""
 
 
 def upsert_instance(conn: sqlite3.Connection, instance: dict, account: str = None):
@@ -176,6 +241,14 @@ def mark_initialized(conn: sqlite3.Connection, instance_id: str):
     conn.commit()
 
 
+def _instance_from_row(row: sqlite3.Row) -> dict:
+    """Convert an instances row to a dict, decoding ssh_key_names into a list."""
+    inst = dict(row)
+    names = inst.get("ssh_key_names")
+    inst["ssh_key_names"] = json.loads(names) if names else []
+    return inst
+
+
 def get_uninitialized_instances(conn: sqlite3.Connection, account: str = None) -> list[dict]:
     """Get instances that haven't been initialized yet, optionally filtered by account."""
     if account:
@@ -188,7 +261,7 @@ def get_uninitialized_instances(conn: sqlite3.Connection, account: str = None) -
             SELECT * FROM instances 
             WHERE initialized = 0 AND status = 'active'
         """).fetchall()
-    return [dict(row) for row in rows]
+    return [_instance_from_row(row) for row in rows]
 
 
 def get_active_instances(conn: sqlite3.Connection, account: str = None) -> list[dict]:
@@ -201,7 +274,7 @@ def get_active_instances(conn: sqlite3.Connection, account: str = None) -> list[
         rows = conn.execute("""
             SELECT * FROM instances WHERE status = 'active'
         """).fetchall()
-    return [dict(row) for row in rows]
+    return [_instance_from_row(row) for row in rows]
 
 
 def get_instances_by_account(conn: sqlite3.Connection, account: str) -> list[dict]:
@@ -209,15 +282,17 @@ def get_instances_by_account(conn: sqlite3.Connection, account: str) -> list[dic
     rows = conn.execute("""
         SELECT * FROM instances WHERE account = ?
     """, (account,)).fetchall()
-    return [dict(row) for row in rows]
+    return [_instance_from_row(row) for row in rows]
 
 
 def add_gpu_sample(conn: sqlite3.Connection, instance_id: str, utilization: int, gpu_index: int = 0):
     """Record a GPU utilization sample."""
+    now = time.time()
     conn.execute(
         "INSERT INTO gpu_samples (instance_id, gpu_index, utilization, timestamp) VALUES (?, ?, ?, ?)",
-        (instance_id, gpu_index, utilization, time.time())
+        (instance_id, gpu_index, utilization, now)
     )
+    conn.execute(_ROLLUP_ADD_MINUTE, (instance_id, usage_bucket_start(now)))
     conn.commit()
 
 
@@ -233,6 +308,34 @@ def add_storage_sample(conn: sqlite3.Connection, instance_id: str, mount_point:
     conn.commit()
 
 
+def add_gpu_samples_bulk(conn: sqlite3.Connection, rows: list[tuple[str, int, int]]):
+    """Record many GPU samples in one transaction. rows are (instance_id, utilization, gpu_index)."""
+    now = time.time()
+    with conn:
+        conn.executemany(
+            "INSERT INTO gpu_samples (instance_id, gpu_index, utilization, timestamp) VALUES (?, ?, ?, ?)",
+            [(instance_id, gpu_index, utilization, now) for instance_id, utilization, gpu_index in rows]
+        )
+        # All of an instance's GPUs share this timestamp: one sampled minute per instance
+        bucket_start = usage_bucket_start(now)
+        conn.executemany(_ROLLUP_ADD_MINUTE, [(instance_id, bucket_start) for instance_id in dict.fromkeys(r[0] for r in rows)])
+
+
+def add_storage_samples_bulk(conn: sqlite3.Connection, rows: list[tuple]):
+    """
+    Record many storage samples in one transaction. rows are
+    (instance_id, mount_point, total_gb, used_gb, available_gb, use_percent).
+    """
+    now = time.time()
+    with conn:
+        conn.executemany(
+            """INSERT INTO storage_samples 
+               (instance_id, mount_point, total_gb, used_gb, available_gb, use_percent, timestamp) 
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            [(*row, now) for row in rows]
+        )
+
+
 def get_latest_storage(conn: sqlite3.Connection, instance_id: str) -> list[dict]:
     """Get the most recent storage samples for an instance."""
     rows = conn.execute("""
@@ -253,6 +356,30 @@ def get_latest_storage(conn: sqlite3.Connection, instance_id: str) -> list[dict]
     return results
 
 
+def get_latest_storage_bulk(conn: sqlite3.Connection, instance_ids: list[str], since_timestamp: float) -> dict[str, list[dict]]:
+    """Get the most recent storage sample per mount point for several instances, keyed by instance_id."""
+    if not instance_ids:
+        return {}
+    placeholders = ",".join("?" * len(instance_ids))
+    rows = conn.execute(f"""
+        SELECT instance_id, mount_point, total_gb, used_gb, available_gb, use_percent, timestamp
+        FROM storage_samples
+        WHERE instance_id IN ({placeholders}) AND timestamp > ?
+        ORDER BY instance_id, timestamp DESC
+    """, (*instance_ids, since_timestamp)).fetchall()
+    
+    # Deduplicate by (instance_id, mount_point) (keep most recent)
+    seen = set()
+    results = {}
+    for row in rows:
+        key = (row["instance_id"], row["mount_point"])
+        if key not in seen:
+            seen.add(key)
+            sample = dict(row)
+            results.setdefault(sample.pop("instance_id"), []).append(sample)
+    return results
+
+
 def get_gpu_samples_since(conn: sqlite3.Connection, instance_id: str, since_timestamp: float) -> list[dict]:
     """Get GPU samples for an instance since a given timestamp."""
     rows = conn.execute("""
@@ -263,6 +390,40 @@ def get_gpu_samples_since(conn: sqlite3.Connection, instance_id: str, since_time
     return [dict(row) for row in rows]
 
 
+def get_gpu_samples_bulk(conn: sqlite3.Connection, instance_ids: list[str], since_timestamp: float) -> Iterator[dict]:
+    """
+    Get GPU samples for several instances since a given timestamp, ordered by instance then time.
+    Rows are streamed from the cursor as they are consumed rather than fetched into a list first.
+    """
+    if not instance_ids:
+        return iter(())
+    placeholders = ",".join("?" * len(instance_ids))
+    cursor = conn.execute(f"""
+        SELECT instance_id, timestamp, utilization FROM gpu_samples 
+        WHERE instance_id IN ({placeholders}) AND timestamp > ?
+        ORDER BY instance_id, timestamp
+    """, (*instance_ids, since_timestamp))
+    return (dict(row) for row in cursor)
+
+
+def get_last_active_bulk(conn: sqlite3.Connection, instance_ids: list[str], since_timestamp: float) -> dict[str, float]:
+    """Get the timestamp of each instance's most recent non-zero GPU sample since a given timestamp."""
+    if not instance_ids:
+        return {}
+    placeholders = ",".join("?" * len(instance_ids))
+    # One statement, but each instance walks the (instance_id, timestamp) index newest-first
+    # and stops at its first non-zero sample instead of aggregating the whole window
+    rows = conn.execute(f"""
+        SELECT id, (
+            SELECT timestamp FROM gpu_samples
+            WHERE instance_id = instances.id AND timestamp > ? AND utilization != 0
+            ORDER BY timestamp DESC LIMIT 1
+        ) AS last_active
+        FROM instances WHERE id IN ({placeholders})
+    """, (since_timestamp, *instance_ids)).fetchall()
+    return {row["id"]: row["last_active"] for row in rows if row["last_active"] is not None}
+
+
 def update_cost(conn: sqlite3.Connection, ssh_key: str, cents_to_add: int):
     """Add cost to an SSH key's running total (legacy, kept for compatibility)."""
     now = time.time()
@@ -295,6 +456,35 @@ def update_account_cost(conn: sqlite3.Connection, account: str, cents_to_add: in
     conn.commit()
 
 
+def update_costs_bulk(
+    conn: sqlite3.Connection,
+    key_costs: list[tuple[str, int]],
+    account: str,
+    account_cents: int,
+):
+    """
+    Add per-SSH-key costs and an account's cost in a single transaction.
+    key_costs is a list of (ssh_key, cents_to_add) pairs.
+    """
+    now = time.time()
+    with conn:
+        conn.executemany("""
+            INSERT INTO costs (ssh_key, total_cents, last_updated)
+            VALUES (?, ?, ?)
+            ON CONFLICT(ssh_key) DO UPDATE SET
+                total_cents = total_cents + excluded.total_cents,
+                last_updated = excluded.last_updated
+        """, [(ssh_key, cents, now) for ssh_key, cents in key_costs])
+        if account_cents > 0:
+            conn.execute("""
+                INSERT INTO account_costs (account, total_cents, last_updated)
+                VALUES (?, ?, ?)
+                ON CONFLICT(account) DO UPDATE SET
+                    total_cents = total_cents + excluded.total_cents,
+                    last_updated = excluded.last_updated
+            """, (account, account_cents, now))
+
+
 def get_all_account_costs(conn: sqlite3.Connection) -> list[dict]:
     """Get cost totals for all accounts."""
     rows = conn.execute("SELECT * FROM account_costs ORDER BY total_cents DESC").fetchall()
@@ -310,11 +500,24 @@ def get_account_cost(conn: sqlite3.Connection, account: str) -> int:
     return row["total_cents"] if row else 0
 
 
-def cleanup_old_samples(conn: sqlite3.Connection, older_than_hours: int = 24):
-    """Remove GPU and storage samples older than specified hours."""
-    cutoff = time.time() - (older_than_hours * 3600)
+def cleanup_old_samples(
+    conn: sqlite3.Connection,
+    older_than_hours: int = 24,
+    rollup_older_than_hours: int = 24 * 30,
+    probe_state_older_than_seconds: int = 3600,
+):
+    """
+    Remove GPU and storage samples older than specified hours (hourly usage rollups are kept longer),
+    and probe failure records not updated for probe_state_older_than_seconds. A host that is still
+    polled refreshes its record at least once per backoff period, so stale records belong to
+    instances that are gone (which usually fail their last probe and are never cleared).
+    """
+    now = time.time()
+    cutoff = now - (older_than_hours * 3600)
     conn.execute("DELETE FROM gpu_samples WHERE timestamp < ?", (cutoff,))
     conn.execute("DELETE FROM storage_samples WHERE timestamp < ?", (cutoff,))
+    conn.execute("DELETE FROM usage_rollup WHERE bucket_start < ?", (now - rollup_older_than_hours * 3600,))
+    conn.execute("DELETE FROM gpu_probe_state WHERE last_failure < ?", (now - probe_state_older_than_seconds,))
     conn.commit()
 
 
@@ -341,6 +544,66 @@ def get_availability_history(conn: sqlite3.Connection, hours: int = 24) -> list[
     return [dict(row) for row in rows]
 
 
+def aggregate_availability(conn: sqlite3.Connection, hours: int = 24) -> tuple[list[tuple], int]:
+    """
+    Aggregate availability over the last N hours in 10-minute check slots.
+    Returns ([(instance_type, region, slots_available), ...], total_slots).
+    """
+    cutoff = time.time() - (hours * 3600)
+    rows = conn.execute("""
+        SELECT instance_type, region, COUNT(DISTINCT CAST(timestamp / 600 AS INTEGER))
+        FROM availability
+        WHERE timestamp > ?
+        GROUP BY instance_type, region
+    """, (cutoff,)).fetchall()
+    total = conn.execute("""
+        SELECT COUNT(DISTINCT CAST(timestamp / 600 AS INTEGER))
+        FROM availability
+        WHERE timestamp > ?
+    """, (cutoff,)).fetchone()[0]
+    return [tuple(row) for row in rows], total
+
+
+def get_availability_counts(
+    conn: sqlite3.Connection,
+    hours: int = 168,
+    region_like: str = None,
+    gpu_like: str = None,
+) -> tuple[list[tuple], list[tuple]]:
+    """
+    Aggregate availability over the last N hours by local weekday (0=Monday)
+    and 4-hour block (0-5). region_like / gpu_like keep only counts whose region /
+    instance type contains that substring (case-insensitive); checks are never filtered.
+    Returns (counts, checks):
+        counts: [(region, instance_type, day_idx, block_idx, available_count), ...]
+        checks: [(day_idx, block_idx, distinct 10-minute check slots), ...]
+    """
+    cutoff = time.time() - (hours * 3600)
+    slotted = """
+        WITH slotted AS (
+            SELECT region, instance_type,
+                   (CAST(strftime('%w', timestamp, 'unixepoch', 'localtime') AS INTEGER) + 6) % 7 AS day_idx,
+                   CAST(strftime('%H', timestamp, 'unixepoch', 'localtime') AS INTEGER) / 4 AS block_idx,
+                   CAST(timestamp / 600 AS INTEGER) AS slot
+            FROM availability
+            WHERE timestamp > :cutoff
+        )
+    """
+    counts = conn.execute(slotted + """
+        SELECT region, instance_type, day_idx, block_idx, COUNT(*)
+        FROM slotted
+        WHERE (:region IS NULL OR instr(lower(region), lower(:region)) > 0)
+          AND (:gpu IS NULL OR instr(lower(instance_type), lower(:gpu)) > 0)
+        GROUP BY region, instance_type, day_idx, block_idx
+    """, {"cutoff": cutoff, "region": region_like, "gpu": gpu_like}).fetchall()
+    checks = conn.execute(slotted + """
+        SELECT day_idx, block_idx, COUNT(DISTINCT slot)
+        FROM slotted
+        GROUP BY day_idx, block_idx
+    """, {"cutoff": cutoff}).fetchall()
+    return [tuple(row) for row in counts], [tuple(row) for row in checks]
+
+
 def cleanup_old_availability(conn: sqlite3.Connection, older_than_hours: int = 168):
     """Remove availability records older than specified hours (default 1 week)."""
     cutoff = time.time() - (older_than_hours * 3600)
@@ -392,16 +655,51 @@ def update_account_notification(conn: sqlite3.Connection, account: str, notified
     conn.commit()
 
 
+def get_gpu_probe_state(conn: sqlite3.Connection, instance_id: str) -> dict | None:
+    """Get the last probe failure info for an instance (None if last probe succeeded)."""
+    row = conn.execute(
+        "SELECT * FROM gpu_probe_state WHERE instance_id = ?",
+        (instance_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def record_gpu_probe_result(conn: sqlite3.Connection, instance_id: str, ok: bool):
+    """Record a GPU probe outcome: failures bump the count, a success clears it."""
+    if ok:
+        conn.execute("DELETE FROM gpu_probe_state WHERE instance_id = ?", (instance_id,))
+    else:
+        conn.execute("""
+            INSERT INTO gpu_probe_state (instance_id, last_failure, failure_count)
+            VALUES (?, ?, 1)
+            ON CONFLICT(instance_id) DO UPDATE SET
+                last_failure = excluded.last_failure,
+                failure_count = failure_count + 1
+        """, (instance_id, time.time()))
+    conn.commit()
+
+
+def _write_json_if_changed(path: Path, obj) -> bool:
+    """Atomically write obj as JSON, skipping the write if the file already matches."""
+    data = json.dumps(obj, indent=2).encode()
+    try:
+        if path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return True
+
+
 def export_to_json(conn: sqlite3.Connection):
-    """Export all tables to JSON files for inspection."""
+    """Export all tables to JSON files for inspection (unchanged files are not rewritten)."""
     # Instances
-    instances = [dict(row) for row in conn.execute("SELECT * FROM instances").fetchall()]
-    for inst in instances:
-        if inst.get("ssh_key_names"):
-            inst["ssh_key_names"] = json.loads(inst["ssh_key_names"])
+    instances = [_instance_from_row(row) for row in conn.execute("SELECT * FROM instances").fetchall()]
     
-    with open(DATA_DIR / "instances.json", "w") as f:
-        json.dump(instances, f, indent=2)
+    _write_json_if_changed(DATA_DIR / "instances.json", instances)
     
     # GPU history (last 24 hours only for readability)
     cutoff = time.time() - 86400
@@ -410,13 +708,11 @@ def export_to_json(conn: sqlite3.Connection):
         (cutoff,)
     ).fetchall()]
     
-    with open(DATA_DIR / "gpu_history.json", "w") as f:
-        json.dump(samples, f, indent=2)
+    _write_json_if_changed(DATA_DIR / "gpu_history.json", samples)
     
     # Costs
     costs = get_all_costs(conn)
-    with open(DATA_DIR / "costs.json", "w") as f:
-        json.dump(costs, f, indent=2)
+    _write_json_if_changed(DATA_DIR / "costs.json", costs)
 
 
 if __name__ == "__main__":
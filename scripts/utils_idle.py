@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Shared idle-termination policy: thresholds from config.env, the whitelist rule and
+grouping of per-GPU samples into time points.
+
+Used by terminate_idle_instances.py (which acts on it) and show_instances.py (which
+reports it), so both always agree on what counts as idle.
+"""
+
+import utils_config
+
+MIN_RUNTIME_HOURS = float(utils_config.CONFIG.get("MIN_RUNTIME_HOURS", "4"))
+IDLE_SHUTDOWN_HOURS = float(utils_config.CONFIG.get("IDLE_SHUTDOWN_HOURS", "2"))
+
+# Time points needed in the idle window before deciding (80% of one per minute)
+MIN_IDLE_SAMPLES = int(IDLE_SHUTDOWN_HOURS * 60 * 0.8)
+
+
+def is_whitelisted(instance: dict) -> bool:
+    """Check if instance is whitelisted (has 'whitelist' in custom name, case-insensitive)."""
+    # Check the user-set custom name (not the auto-generated hostname)
+    custom_name = instance.get("name") or ""
+    return "whitelist" in custom_name.lower()
+
+
+def group_samples_by_timestamp(samples: list[dict], tolerance: float = 30.0) -> list[dict]:
+    """
+    Group samples by timestamp (within tolerance seconds) and average across GPUs.
+    Returns list of {timestamp, avg_utilization, all_zero, gpu_count}.
+    """
+    if not samples:
+        return []
+    
+    # Samples usually arrive ordered by timestamp, so this sort is a linear pass; then
+    # keep running totals per group instead of building a list for each one
+    points = sorted((s["timestamp"], s["utilization"]) for s in samples)
+    
+    grouped = []
+    group_ts, total, count, all_zero = points[0][0], 0, 0, True
+    
+    for ts, util in points:
+        if ts - group_ts > tolerance:
+            # Finalize current group
+            grouped.append({
+                "timestamp": group_ts,
+                "avg_utilization": total / count,
+                "all_zero": all_zero,
+                "gpu_count": count,
+            })
+            group_ts, total, count, all_zero = ts, 0, 0, True
+        total += util
+        count += 1
+        all_zero = all_zero and util == 0
+    
+    # Don't forget last group
+    grouped.append({
+        "timestamp": group_ts,
+        "avg_utilization": total / count,
+        "all_zero": all_zero,
+        "gpu_count": count,
+    })
+    
+    return grouped
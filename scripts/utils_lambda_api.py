@@ -2,25 +2,64 @@
 """Lambda Labs Cloud API wrapper with multi-account support."""
 
 import os
+import threading
 import time
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # Optional: faster parsing of large instance lists
+except ImportError:
+    orjson = None
 
 BASE_URL = "https://cloud.lambda.ai/api/v1"
 
-# Rate limiting: track last request time per API key
-_last_request_times = {}
+# Rate limiting: at most one request per MIN_REQUEST_INTERVAL seconds per API key
+MIN_REQUEST_INTERVAL = 1.0
+
+# Monotonic time at which each API key's next request may start
+_next_request_times = {}
+_rate_lock = threading.Lock()
+
+# One keep-alive session per API key, so consecutive calls reuse the TLS connection
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Retry idempotent requests on throttling and transient server errors (honours Retry-After).
+# Once retries run out the last response is returned, so raise_for_status() still raises HTTPError
+_RETRY = Retry(total=3, backoff_factor=1.0, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
 
 
 def _rate_limit(api_key: str):
-    """Ensure we don't exceed 1 request per second per API key."""
-    global _last_request_times
-    last = _last_request_times.get(api_key, 0)
-    elapsed = time.time() - last
-    if elapsed < 1.0:
-        time.sleep(1.0 - elapsed)
-    _last_request_times[api_key] = time.time()
+    """
+    Ensure we don't exceed 1 request per second per API key.
+    
+    Each caller reserves the key's next slot under a short lock and sleeps outside it,
+    so concurrent callers on one key are spaced out and other keys are never blocked.
+    """
+    with _rate_lock:
+        now = time.monotonic()
+        start = max(now, _next_request_times.get(api_key, now))
+        _next_request_times[api_key] = start + MIN_REQUEST_INTERVAL
+    
+    if start > now:
+        time.sleep(start - now)
+
+
+def _get_session(api_key: str) -> requests.Session:
+    """Get (or create) the pooled session for an API key, with its auth headers set."""
+    with _sessions_lock:
+        session = _sessions.get(api_key)
+        if session is None:
+            session = requests.Session()
+            session.headers["Authorization"] = f"Bearer {api_key}"
+            session.headers["Accept"] = "application/json"
+            session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=_RETRY))
+            _sessions[api_key] = session
+        return session
 
 
 def _request(method: str, endpoint: str, api_key: str, **kwargs) -> dict:
@@ -30,14 +69,12 @@ def _request(method: str, endpoint: str, api_key: str, **kwargs) -> dict:
     
     _rate_limit(api_key)
     
-    headers = kwargs.pop("headers", {})
-    headers["Authorization"] = f"Bearer {api_key}"
-    headers["Accept"] = "application/json"
-    
     url = f"{BASE_URL}{endpoint}"
-    response = requests.request(method, url, headers=headers, **kwargs)
+    response = _get_session(api_key).request(method, url, **kwargs)
     response.raise_for_status()
     
+    if orjson is not None:
+        return orjson.loads(response.content)
     return response.json()
 
 